@@ -26,14 +26,42 @@ def call_document_agent(user_query: str) -> str:
 
     return response.choices[0].message.content
 
+def call_document_agent_stream(user_query: str):
+    """Streaming variant of call_document_agent.
+    Yields {"type": "citations", "citations": [...]} as soon as the search returns,
+    then {"type": "delta", "content": ...} for each chunk of the answer."""
+    results = search_documents(user_query)
+    yield {"type": "citations", "citations": [{"id": doc["id"], "title": doc["title"]} for doc in results]}
+    context = "\n\n".join([f"Titre: {doc['title']}\nContenu: {doc['content']}" for doc in results])
+
+    stream = client.chat.completions.create(
+        model=deployment,
+        messages=[
+            {"role": "system", "content": f"Voici des procédures extraites d'une base documentaire :\n{context}"},
+            {"role": "user", "content": user_query}
+        ],
+        max_tokens=1024,
+        temperature=0.5,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield {"type": "delta", "content": chunk.choices[0].delta.content}
+
 
 
 
 import os
 import json
-import pyodbc
+import time
+import hashlib
 from dotenv import load_dotenv
 from openai import AzureOpenAI
+from openai.types.chat import ChatCompletion
+from utils.cache_utils import TTLCache
+from utils.search_utils import get_index_version
+from utils.sql_utils import ConnectionPool, SQL_BACKEND, get_sqlite_connection
+from utils.conversation_utils import ConversationMemory, summarize_extractively
 
 # Load environment variables
 load_dotenv("./.env", override=True)
@@ -63,61 +91,209 @@ def get_openai_client():
         api_key=api_key,
     )
 
-# Query SQL Server for metadata
-def query_sql_metadata():
+if SQL_BACKEND != "sqlite":
+    import pyodbc
+
+# SQL metadata cache: shared by every turn and session of this process
+# Example query; the SQLite database (SQL_BACKEND=sqlite) only holds the documents table of sql_utils,
+# so that mode reads the book/chapter metadata from it instead of the SQL Server Books table
+METADATA_QUERY = "SELECT * FROM documents LIMIT 5" if SQL_BACKEND == "sqlite" else "SELECT TOP 5 * FROM Books"
+METADATA_CACHE_TTL = float(os.getenv("SQL_METADATA_CACHE_TTL", "300"))
+METADATA_CACHE = TTLCache(maxsize=8, ttl=METADATA_CACHE_TTL)
+
+def connect_metadata_db():
+    if SQL_BACKEND == "sqlite":
+        return get_sqlite_connection()
+    conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={sql_server};DATABASE={sql_database};UID={sql_user};PWD={sql_password}"
+    return pyodbc.connect(conn_str)
+
+# Connections are opened on first use and reused across turns
+metadata_pool = ConnectionPool(connect_metadata_db, min_size=0, max_size=2)
+
+# Query SQL Server for metadata (read-through cache, errors are not cached)
+def query_sql_metadata(force_refresh=False):
+    if not force_refresh:
+        cached = METADATA_CACHE.get(METADATA_QUERY)
+        if cached is not None:
+            return cached
     try:
-        conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={sql_server};DATABASE={sql_database};UID={sql_user};PWD={sql_password}"
-        conn = pyodbc.connect(conn_str)
-        cursor = conn.cursor()
-        cursor.execute("SELECT TOP 5 * FROM Books")  # Example query
-        rows = cursor.fetchall()
+        with metadata_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(METADATA_QUERY)
+            rows = cursor.fetchall()
+            cursor.close()
         metadata = "\n".join([str(row) for row in rows])
+        METADATA_CACHE.set(METADATA_QUERY, metadata)
         return metadata
     except Exception as e:
         return f"Error querying SQL Server: {e}"
 
+# Drop the cached metadata, e.g. after the metadata table was modified
+def invalidate_metadata_cache():
+    METADATA_CACHE.clear()
+
+# Azure Search data source used by the "on your data" completions
+def get_data_sources():
+    return [
+        {
+            "type": "azure_search",
+            "parameters": {
+                "endpoint": endpoint_ai_search,
+                "index_name": search_index_name,
+                "authentication": {
+                    "type": "api_key",
+                    "key": api_key_ai_search,
+                },
+                "top_n_documents": 3,
+                "fields_mapping": {
+                    "title_field": "chapter_name",
+                    "filepath_field": "file",
+                    "content_fields": ["chunk_content", "book", "chapter_name"],
+                    "vector_fields": ["vector"],
+                },
+            },
+        }
+    ]
+
+# Response cache: answers and citations keyed by the conversation tail, the data source and the index version
+# 0 (default) keys on every user/assistant message in the window; N > 0 keeps only the last N
+RESPONSE_CACHE_TAIL_MESSAGES = int(os.getenv("RESPONSE_CACHE_TAIL_MESSAGES", "0"))
+RESPONSE_CACHE = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+)
+
+def response_cache_key(messages):
+    # every system message (prompt, SQL metadata context, summary) plus the conversation tail,
+    # so follow-ups like "tell me more" only match the same conversation; whitespace and case normalized
+    system = [m for m in messages if m["role"] == "system"]
+    conversation = [m for m in messages if m["role"] != "system"]
+    if RESPONSE_CACHE_TAIL_MESSAGES > 0:
+        conversation = conversation[-RESPONSE_CACHE_TAIL_MESSAGES:]
+    normalized = [(m["role"], " ".join((m["content"] or "").lower().split())) for m in system + conversation]
+    # the API key is left out of the key, everything else describing the data source is part of it
+    data_sources = get_data_sources()
+    for source in data_sources:
+        source["parameters"].pop("authentication", None)
+    payload = json.dumps([normalized, data_sources, deployment], sort_keys=True, ensure_ascii=False)
+    return search_index_name, get_index_version(search_index_name), hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def invalidate_response_cache():
+    RESPONSE_CACHE.clear()
+
+def cached_completion(entry):
+    # rebuild a ChatCompletion so callers read .choices[0].message.content / .context as usual
+    message = {"role": "assistant", "content": entry["answer"]}
+    if entry["context"] is not None:
+        message["context"] = entry["context"]
+    return ChatCompletion.model_validate({
+        "id": "cached",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment or "",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+    })
+
 # Get response from Azure OpenAI with Azure Search integration
-def get_response(messages):
+def get_response(messages, use_cache=True):
+    if use_cache:
+        key = response_cache_key(messages)
+        entry = RESPONSE_CACHE.get(key)
+        if entry is not None:
+            return cached_completion(entry)
+
     client = get_openai_client()
     response = client.chat.completions.create(
         messages=messages,
-        extra_body={
-            "data_sources": [
-                {
-                    "type": "azure_search",
-                    "parameters": {
-                        "endpoint": endpoint_ai_search,
-                        "index_name": search_index_name,
-                        "authentication": {
-                            "type": "api_key",
-                            "key": api_key_ai_search,
-                        },
-                        "top_n_documents": 3,
-                        "fields_mapping": {
-                            "title_field": "chapter_name",
-                            "filepath_field": "file",
-                            "content_fields": ["chunk_content", "book", "chapter_name"],
-                            "vector_fields": ["vector"],
-                        },
-                    },
-                }
-            ]
-        },
+        extra_body={"data_sources": get_data_sources()},
         max_tokens=4096,
         temperature=0.7,
         top_p=1.0,
         model=deployment,
     )
+    if use_cache:
+        message = response.choices[0].message
+        RESPONSE_CACHE.set(key, {"answer": message.content, "context": getattr(message, "context", None)})
     return response
 
+# Streaming variant of get_response, yields typed events:
+# - {"type": "citations", "citations": [...]} as soon as the data source context arrives (first chunk)
+# - {"type": "delta", "content": "..."} for each piece of the answer
+# - {"type": "done", "answer": "...", "citations": [...]} at the end
+# A cached answer is replayed as one delta with the same citations.
+def get_response_stream(messages, use_cache=True):
+    if use_cache:
+        key = response_cache_key(messages)
+        entry = RESPONSE_CACHE.get(key)
+        if entry is not None:
+            citations = (entry["context"] or {}).get("citations", [])
+            if citations:
+                yield {"type": "citations", "citations": citations}
+            yield {"type": "delta", "content": entry["answer"]}
+            yield {"type": "done", "answer": entry["answer"], "citations": citations}
+            return
+
+    client = get_openai_client()
+    stream = client.chat.completions.create(
+        messages=messages,
+        extra_body={"data_sources": get_data_sources()},
+        max_tokens=4096,
+        temperature=0.7,
+        top_p=1.0,
+        model=deployment,
+        stream=True,
+    )
+    parts = []
+    citations = []
+    full_context = None
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        context = getattr(delta, "context", None)
+        if context:
+            full_context = context
+        if context and context.get("citations"):
+            citations = context["citations"]
+            yield {"type": "citations", "citations": citations}
+        if delta.content:
+            parts.append(delta.content)
+            yield {"type": "delta", "content": delta.content}
+    answer = "".join(parts)
+    if use_cache:
+        RESPONSE_CACHE.set(key, {"answer": answer, "context": full_context})
+    yield {"type": "done", "answer": answer, "citations": citations}
+
+# Conversation memory budget (prompt tokens sent per turn, excluding the answer)
+HISTORY_MAX_TOKENS = int(os.getenv("DOCUMENT_AGENT_HISTORY_MAX_TOKENS", "3000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("DOCUMENT_AGENT_SUMMARY_MAX_TOKENS", "300"))
+
+# Fold older turns into the rolling summary with the chat model
+def summarize_turns(summary, turns, max_tokens):
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for turn in turns for message in turn)
+    try:
+        response = get_openai_client().chat.completions.create(
+            messages=[
+                {"role": "system", "content": "Summarize this conversation in a few sentences, keeping the facts, "
+                                              "questions and conclusions needed to continue it."},
+                {"role": "user", "content": f"Previous summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+            max_tokens=max_tokens,
+            temperature=0,
+            model=deployment,
+        )
+        return response.choices[0].message.content
+    except Exception:
+        return summarize_extractively(summary, turns, max_tokens)
+
 # Main interactive loop
 def main():
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a helpful assistant specialized in economic theory and document analysis.",
-        }
-    ]
+    memory = ConversationMemory(
+        "You are a helpful assistant specialized in economic theory and document analysis.",
+        max_tokens=HISTORY_MAX_TOKENS,
+        summary_max_tokens=SUMMARY_MAX_TOKENS,
+        summarizer=summarize_turns,
+    )
 
     while True:
         user_input = input("User: What is your question? (type 'exit' to quit): ")
@@ -125,20 +301,26 @@ def main():
             break
 
         # Append user message
-        messages.append({"role": "user", "content": user_input})
+        memory.add_user(user_input)
 
-        # Optionally enrich with SQL metadata
+        # Optionally enrich with SQL metadata (replaces the previous metadata message)
         metadata = query_sql_metadata()
         if metadata:
-            messages.append({"role": "system", "content": f"Here is some metadata from SQL Server:\n{metadata}"})
+            memory.set_context("sql_metadata", f"Here is some metadata from SQL Server:\n{metadata}")
 
-        # Get response from OpenAI
-        response = get_response(messages)
-        answer = response.choices[0].message.content
-        print("\nAssistant:", answer)
+        # Stream the response from OpenAI
+        print("\nAssistant: ", end="", flush=True)
+        answer = ""
+        citations = []
+        for event in get_response_stream(memory.messages()):
+            if event["type"] == "delta":
+                print(event["content"], end="", flush=True)
+            elif event["type"] == "done":
+                answer = event["answer"]
+                citations = event["citations"]
+        print()
 
         # Show citations
-        citations = response.choices[0].message.context.get("citations", [])
         if citations:
             print("\nCitations:")
             for citation in citations:
@@ -147,7 +329,11 @@ def main():
             print("\nNo citations found.")
 
         # Append assistant message
-        messages.append({"role": "assistant", "content": answer})
+        memory.add_assistant(answer)
+
+        usage = memory.last_usage
+        print(f"\n[prompt tokens: {usage['total']} (history {usage['history']}, summary {usage['summary']}, "
+              f"context {usage['context']}), {usage['turns_summarized']} turns summarized]")
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,8 @@ from azure.cognitiveservices.vision.customvision.training import CustomVisionTra
 from azure.cognitiveservices.vision.customvision.prediction import CustomVisionPredictionClient
 from azure.cognitiveservices.vision.customvision.training.models import ImageFileCreateBatch, ImageFileCreateEntry, Region
 from msrest.authentication import ApiKeyCredentials
-import os, sys, time, uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os, sys, time, uuid, threading
 sys.stdout.reconfigure(encoding='utf-8')
 load_dotenv()
 
@@ -12,6 +13,12 @@ PREDICTION_KEY = os.getenv("AZURE_AI_VISION_PREDICTION_KEY")
 PROJECT_ID = os.getenv("AZURE_AI_VISION_PROJECT_ID")
 PUBLISH_ITERATION_NAME = os.getenv("AZURE_AI_VISION_PUBLISH_ITERATION_NAME")
 
+# Analyse par lots : nombre de prédictions simultanées, délai max par image (s)
+# et débit max autorisé par le quota de prédiction Custom Vision (transactions/s)
+IMAGE_BATCH_WORKERS = int(os.getenv("AZURE_AI_VISION_BATCH_WORKERS", "8"))
+IMAGE_TIMEOUT = float(os.getenv("AZURE_AI_VISION_TIMEOUT", "30"))
+IMAGE_MAX_PER_SECOND = float(os.getenv("AZURE_AI_VISION_MAX_PER_SECOND", "10"))
+
 TRAINING_KEY = os.getenv("AZURE_AI_VISION_TRAINING_KEY")
 TRAINING_ENDPOINT = os.getenv("AZURE_AI_VISION_ENDPOINT")
 
@@ -116,26 +123,112 @@ def test_azure_keys_and_endpoints():
     else:
         print("Tout est prêt pour la prédiction.")
     
+def _classify(image_path, rate_limiter=None):
+    if not os.path.exists(image_path):
+        return {"error": f"Image introuvable à ce chemin : {image_path}"}
+
+    with open(image_path, "rb") as image_data:
+        data = image_data.read()
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    results = predictor.classify_image(PROJECT_ID, PUBLISH_ITERATION_NAME, data)
+
+    response = [
+        {
+            "tag_name": prediction.tag_name,
+            "probability": round(prediction.probability * 100, 2)
+        }
+        for prediction in results.predictions
+    ]
+    return {"image": os.path.basename(image_path), "predictions": response}
+
+
 def call_image_agent(image_path):
     """Appel pour l'agent orchestrateur – retourne les prédictions formatées"""
     try:
-        if not os.path.exists(image_path):
-            return {"error": f"Image introuvable à ce chemin : {image_path}"}
+        return _classify(image_path, PREDICTION_RATE_LIMITER)
+    except Exception as e:
+        return {"error": f"Erreur lors de la prédiction : {str(e)}"}
 
-        with open(image_path, "rb") as image_data:
-            results = predictor.classify_image(PROJECT_ID, PUBLISH_ITERATION_NAME, image_data.read())
 
-        response = [
-            {
-                "tag_name": prediction.tag_name,
-                "probability": round(prediction.probability * 100, 2)
-            }
-            for prediction in results.predictions
-        ]
-        return {"image": os.path.basename(image_path), "predictions": response}
+class RateLimiter:
+    """Seau à jetons thread-safe : au plus `rate` appels par seconde, avec des rafales de `burst` appels."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+# Limiteur partagé par tous les appels du processus : le quota Custom Vision est global,
+# quel que soit le nombre de lots ou de requêtes simultanés
+PREDICTION_RATE_LIMITER = RateLimiter(IMAGE_MAX_PER_SECOND) if IMAGE_MAX_PER_SECOND > 0 else None
+
+
+def call_image_agent_batch(image_paths, max_workers=None, timeout=None, max_per_second=None):
+    """
+    Analyse une liste d'images en parallèle (pool borné, débit limité par seau à jetons).
+    Retourne un résultat par image, dans l'ordre des chemins, au format de call_image_agent :
+    une image en échec ou dépassant `timeout` secondes donne un dict {"error": ...} sans bloquer les autres.
+    Le débit est celui du limiteur partagé PREDICTION_RATE_LIMITER ; `max_per_second` le remplace
+    par un limiteur propre à ce lot (0 pour ne pas limiter).
+    """
+    image_paths = list(image_paths)
+    if not image_paths:
+        return []
+    max_workers = max_workers or IMAGE_BATCH_WORKERS
+    timeout = IMAGE_TIMEOUT if timeout is None else timeout
+    if max_per_second is None:
+        rate_limiter = PREDICTION_RATE_LIMITER
+    else:
+        rate_limiter = RateLimiter(max_per_second) if max_per_second > 0 else None
 
-    except Exception as e:
-        return {"error": f"Erreur lors de la prédiction : {str(e)}"}
+    results = [None] * len(image_paths)
+    started = {}
+
+    def task(index):
+        started[index] = time.monotonic()
+        return _classify(image_paths[index], rate_limiter)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(image_paths)))
+    try:
+        futures = {executor.submit(task, index): index for index in range(len(image_paths))}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=min(1.0, timeout) if timeout else None,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = {"error": f"Erreur lors de la prédiction : {str(e)}"}
+            if timeout:
+                # le délai d'une image court à partir du début de son traitement, pas de la soumission
+                now = time.monotonic()
+                expired = {f for f in pending if futures[f] in started and now - started[futures[f]] > timeout}
+                for future in expired:
+                    future.cancel()
+                    results[futures[future]] = {"error": f"Délai de prédiction dépassé ({timeout:.0f} s)"}
+                pending -= expired
+    finally:
+        # n'attend pas les appels expirés encore en cours
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
 
 
 if __name__ == "__main__":
@@ -66,6 +66,7 @@ import json
 import logging
 from typing import Optional, Tuple, Dict, Any
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 from langchain.chat_models import AzureChatOpenAI
@@ -78,6 +79,10 @@ logging.basicConfig(level=logging.INFO)
 AZURE_MAPS_KEY = os.getenv("AZURE_MAPS_KEY")
 AZURE_MAPS_ENDPOINT = os.getenv("AZURE_MAPS_ENDPOINT").rstrip("/") if os.getenv("AZURE_MAPS_ENDPOINT") else None
 
+# Session partagée : les connexions HTTPS vers Azure Maps restent ouvertes d'un appel à l'autre
+MAPS_SESSION = requests.Session()
+MAPS_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=int(os.getenv("AZURE_MAPS_POOL_SIZE", "10"))))
+
 # LangChain / Azure LLM config
 LLM = AzureChatOpenAI(
     deployment_name=os.getenv("AI_MODEL_DEPLOYMENT_NAME") or os.getenv("AI_MODEL_DEPLOYMENT"),
@@ -137,7 +142,7 @@ def get_coordinates_from_location(location: str) -> Optional[Tuple[float, float]
         "query": location,
     }
     try:
-        r = requests.get(url, params=params, timeout=10)
+        r = MAPS_SESSION.get(url, params=params, timeout=10)
         r.raise_for_status()
         data = r.json()
         if data.get("results"):
@@ -163,7 +168,7 @@ def get_weather_forecast(lat: float, lon: float, duration: int = 5) -> Optional[
         "duration": duration,
     }
     try:
-        r = requests.get(url, params=params, timeout=10)
+        r = MAPS_SESSION.get(url, params=params, timeout=10)
         r.raise_for_status()
         return r.json()
     except Exception as e:
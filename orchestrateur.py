@@ -156,10 +156,15 @@ if __name__ == "__main__":
 import os
 import re
 import json
+import hashlib
+import time
+import queue
 import logging
-import tempfile
-import urllib.request
-from typing import List, Dict, Optional
+import threading
+from functools import lru_cache
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Optional, Callable, Iterator
 from dotenv import load_dotenv
 
 # LangChain imports
@@ -167,7 +172,12 @@ from langchain.chat_models import AzureChatOpenAI
 from langchain import LLMChain, PromptTemplate
 
 # Ton agent d'image existant (conserve l'API que tu as déjà)
-from agent_image.image_agent_prediction import call_image_agent
+from agent_image.image_agent_prediction import call_image_agent_batch
+from utils.routing_utils import LocalIntentRouter
+from utils.cache_utils import TTLCache, SqliteCache
+from utils.download_utils import ImageDownloader
+from utils.directory_index_utils import DirectoryIndex
+from utils.context_utils import serialize_context
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -194,7 +204,8 @@ DETECT_PROMPT = PromptTemplate(
     input_variables=["message", "agents_json"],
     template=(
         "Tu es un routeur d'agents. Tu reçois un message utilisateur et renvoies une liste JSON ordonnée "
-        "des agents à appeler. Chaque élément doit être un objet avec 'agent' et 'reason'.\n\n"
+        "des agents à appeler. Chaque élément doit être un objet avec 'agent' et 'reason', et optionnellement "
+        "'depends_on': la liste des agents dont il a besoin des résultats.\n\n"
         "Agents disponibles: {agents_json}\n\n"
         "Message utilisateur: {message}\n\n"
         "Réponds uniquement par JSON. Exemple: [{\"agent\": \"document_agent\", \"reason\": \"pour connaître les besoins d'arrosage\"}]"
@@ -219,7 +230,6 @@ FINAL_PROMPT = PromptTemplate(
         "En te basant uniquement sur ces informations, fournis une réponse claire, structurée et concise à la demande de l'utilisateur:\n\n{user_message}"
     ),
 )
-FINAL_CHAIN = LLMChain(llm=LLM, prompt=FINAL_PROMPT)
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff"}
 
@@ -267,44 +277,125 @@ def extract_image_sources(text: str) -> List[Dict[str, str]]:
     return sources
 
 
-def collect_files_from_path(path: str) -> List[str]:
-    """Si path est fichier valide, retourne [file]. Si dossier, explore récursivement et retourne les images.
+# Index des dossiers d'images : listings mis en cache par mtime, seuls les dossiers modifiés sont relus
+DIRECTORY_INDEX = DirectoryIndex(IMAGE_EXTENSIONS)
+IMAGE_SCAN_MAX_FILES = int(os.getenv("IMAGE_SCAN_MAX_FILES", "1000"))
+IMAGE_SKIP_ANALYSED = os.getenv("IMAGE_SKIP_ANALYSED") == "1"
+
+
+def collect_files_from_path(path: str, limit: Optional[int] = IMAGE_SCAN_MAX_FILES,
+                            skip_analysed: bool = IMAGE_SKIP_ANALYSED) -> List[str]:
+    """Si path est fichier valide, retourne [file]. Si dossier, explore récursivement et retourne
+    au plus `limit` images, en ignorant si demandé celles déjà analysées et inchangées.
     Si path n'existe pas, retourne empty list."""
     found: List[str] = []
     try:
-        if os.path.isfile(path):
-            ext = os.path.splitext(path)[1].lower()
-            if ext in IMAGE_EXTENSIONS:
-                found.append(path)
-            return found
-        if os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                for f in files:
-                    if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS:
-                        found.append(os.path.join(root, f))
-            return found
+        found = list(DIRECTORY_INDEX.iter_files(path, limit=limit, skip_analysed=skip_analysed))
+        if limit is not None and len(found) >= limit and os.path.isdir(path):
+            logging.warning("Dossier %s : analyse limitée aux %d premières images", path, limit)
     except Exception as e:
         logging.exception("Erreur en parcourant le chemin local %s: %s", path, e)
     return found
 
 
+@lru_cache(maxsize=1)
+def get_image_downloader() -> ImageDownloader:
+    """Téléchargeur partagé : session HTTP poolée et cache local des images (taille bornée)."""
+    return ImageDownloader()
+
+
 def download_image(url: str) -> Optional[str]:
-    """Télécharge l'image vers un fichier temporaire et retourne le chemin."""
+    """Télécharge l'image (ou la reprend du cache) et retourne le chemin local."""
     try:
-        suffix = os.path.splitext(url.split("?")[0])[-1]
-        if not suffix or len(suffix) > 5:
-            suffix = ".jpg"
-        tf = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        urllib.request.urlretrieve(url, tf.name)
-        logging.info("Image téléchargée: %s", tf.name)
-        return tf.name
+        return get_image_downloader().download(url)
     except Exception as e:
         logging.exception("Erreur téléchargement image %s: %s", url, e)
         return None
 
 
-def detect_intents(user_message: str) -> List[Dict[str, str]]:
-    """Retourne la liste ordonnée d'agents à appeler, déduite par le LLM (JSON)."""
+# Routeur local : évite l'appel LLM de planification quand sa confiance est suffisante
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.75"))
+
+
+def _router_embed(texts: List[str]) -> List[List[float]]:
+    from utils.embeddings_utils import get_embeddings
+    return get_embeddings(texts)
+
+
+INTENT_ROUTER = LocalIntentRouter(embed=_router_embed if os.getenv("ROUTER_USE_EMBEDDINGS") == "1" else None)
+
+
+# Cache des plans : detect_intents est à température 0, un même message normalisé donne le même plan.
+# PLAN_CACHE_PATH active un cache SQLite persistant partagé entre processus.
+PLAN_CACHE = TTLCache(
+    maxsize=int(os.getenv("PLAN_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PLAN_CACHE_TTL", "86400")),
+)
+PLAN_STORE = SqliteCache(os.getenv("PLAN_CACHE_PATH"), ttl=PLAN_CACHE.ttl) if os.getenv("PLAN_CACHE_PATH") else None
+UNIX_PATH_REGEX = re.compile(r"(?<!\S)(?:\.{1,2}/|/|~/)\S+")
+
+_plan_cache_lock = threading.Lock()
+_plan_cache_fingerprint = None
+
+
+def agents_fingerprint() -> str:
+    """Empreinte de la définition des agents et du prompt de planification."""
+    definition = json.dumps([AVAILABLE_AGENTS, DETECT_PROMPT.template], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(definition.encode("utf-8")).hexdigest()[:16]
+
+
+def plan_cache_key(user_message: str) -> str:
+    """Clé du cache : empreinte des agents + message normalisé, URLs et chemins remplacés par des marqueurs."""
+    global _plan_cache_fingerprint
+    fingerprint = agents_fingerprint()
+    with _plan_cache_lock:
+        if fingerprint != _plan_cache_fingerprint:
+            # la liste des agents a changé : les plans en cache ne sont plus valables
+            if _plan_cache_fingerprint is not None:
+                PLAN_CACHE.clear()
+            if PLAN_STORE is not None:
+                PLAN_STORE.purge(keep_prefix=f"{fingerprint}:")
+            _plan_cache_fingerprint = fingerprint
+    text = URL_REGEX.sub("<url>", user_message)
+    text = WINDOWS_PATH_REGEX.sub("<path>", text)
+    text = UNIX_PATH_REGEX.sub("<path>", text)
+    text = " ".join(text.lower().split())
+    return f"{fingerprint}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def is_valid_plan(plan) -> bool:
+    """Un plan est une liste non vide d'étapes dict ayant chacune un champ 'agent' de type str."""
+    return isinstance(plan, list) and bool(plan) and \
+        all(isinstance(step, dict) and isinstance(step.get("agent"), str) for step in plan)
+
+
+def detect_intents(user_message: str, image_sources: Optional[List[Dict[str, str]]] = None,
+                   scores: Optional[Dict[str, float]] = None) -> List[Dict[str, str]]:
+    """Retourne la liste ordonnée d'agents à appeler.
+    Essaie d'abord le routeur local (mots-clés, sources d'images, embeddings optionnels),
+    puis se rabat sur le LLM (JSON) si la confiance locale est trop faible.
+    `scores` reprend les scores du routeur déjà calculés pour ce message (ex. par la spéculation)."""
+    if image_sources is None:
+        image_sources = extract_image_sources(user_message)
+    plan, confidence = INTENT_ROUTER.route(user_message, image_sources, scores)
+    if plan and confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+        INTENT_ROUTER.record(local=True)
+        logging.info("Plan routé localement (confiance %.2f, %s)", confidence, INTENT_ROUTER.stats())
+        return plan
+    INTENT_ROUTER.record(local=False)
+
+    cache_key = plan_cache_key(user_message)
+    cached = PLAN_CACHE.get(cache_key)
+    if cached is None and PLAN_STORE is not None:
+        cached = PLAN_STORE.get(cache_key)
+        if cached is not None:
+            PLAN_CACHE.set(cache_key, cached)
+    # une entrée persistée par une version antérieure peut être invalide : on l'ignore
+    if cached is not None and is_valid_plan(cached):
+        logging.info("Plan trouvé en cache")
+        return [dict(step) for step in cached]
+
+    logging.info("Confiance locale %.2f insuffisante, appel du LLM (%s)", confidence, INTENT_ROUTER.stats())
     prompt_inputs = {
         "message": user_message,
         "agents_json": json.dumps(AVAILABLE_AGENTS, ensure_ascii=False),
@@ -312,10 +403,15 @@ def detect_intents(user_message: str) -> List[Dict[str, str]]:
     raw = DETECT_CHAIN.run(prompt_inputs)
     try:
         parsed = json.loads(raw.strip())
-        if isinstance(parsed, list):
-            return parsed
     except Exception:
-        logging.warning("Impossible de parser la sortie du détecteur d'intent. Sortie brute: %s", raw)
+        parsed = None
+    if is_valid_plan(parsed):
+        # seuls les plans valides sont mis en cache
+        PLAN_CACHE.set(cache_key, parsed)
+        if PLAN_STORE is not None:
+            PLAN_STORE.set(cache_key, parsed)
+        return [dict(step) for step in parsed]
+    logging.warning("Sortie du détecteur d'intent invalide. Sortie brute: %s", raw)
     return [{"agent": "general", "reason": "aucun agent spécifique détecté"}]
 
 
@@ -323,106 +419,484 @@ def call_general_agent(message: str) -> str:
     return GENERAL_CHAIN.run({"message": message})
 
 
-def orchestrate(user_message: str) -> Dict[str, object]:
-    """Orchestre les appels aux agents et renvoie un dict structuré de résultats.
+def run_document_agent(user_message: str, image_sources: List[Dict[str, str]], upstream: Dict[str, object]) -> Dict[str, object]:
+    # TODO: remplacer par ton vrai appel au document_agent
+    return {"document": "[simulation] fiche documentaire: arroser 2x/semaine"}
 
-    - Prend en charge plusieurs images trouvées dans le message.
-    - Supporte URLs, fichiers locaux et dossiers locaux (ex: C:/images ou /home/user/images).
-    - Retourne la liste des résultats d'analyse image dans context['images']."""
-    plan = detect_intents(user_message)
-    context: Dict[str, object] = {}
 
-    # Extraire les sources d'images mentionnées dans le message
-    image_sources = extract_image_sources(user_message)
-    logging.info("Sources d'images détectées: %s", image_sources)
+def run_weather_agent(user_message: str, image_sources: List[Dict[str, str]], upstream: Dict[str, object]) -> Dict[str, object]:
+    # TODO: remplacer par ton vrai appel au weather_agent
+    return {"weather": "[simulation] pluie possible dans 6h"}
 
-    for step in plan:
-        agent = step.get("agent")
-        reason = step.get("reason", "")
-        logging.info("Step agent: %s — %s", agent, reason)
 
-        if agent == "document_agent":
-            # TODO: remplacer par ton vrai appel au document_agent
-            context["document"] = "[simulation] fiche documentaire: arroser 2x/semaine"
+def run_image_agent(user_message: str, image_sources: List[Dict[str, str]], upstream: Dict[str, object]) -> Dict[str, object]:
+    # Si l'utilisateur n'a fourni aucun source mais que le message contient un chemin relatif qui existe,
+    # extract_image_sources l'aura déjà trouvé. Sinon on peut vérifier un dossier par défaut si besoin.
+    if not image_sources:
+        logging.info("Aucune source d'image trouvée pour image_agent")
+        return {"image": "Aucune source d'image détectée dans le message utilisateur."}
 
-        elif agent == "weather_agent":
-            # TODO: remplacer par ton vrai appel au weather_agent
-            context["weather"] = "[simulation] pluie possible dans 6h"
+    # Toutes les URLs du message sont téléchargées en parallèle avant l'analyse ; les fichiers
+    # restent épinglés dans le cache (non évincés) jusqu'à la fin de l'analyse
+    downloader = get_image_downloader()
+    urls = list(dict.fromkeys(src.get("value") for src in image_sources if src.get("type") == "url"))
+    downloads = dict(zip(urls, downloader.download_many(urls, pin=True))) if urls else {}
+    try:
+        return _analyse_image_sources(image_sources, downloads)
+    finally:
+        for path, _ in downloads.values():
+            if path:
+                downloader.release(path)
 
-        elif agent == "image_agent":
-            images_results = []
 
-            # Si l'utilisateur n'a fourni aucun source mais que le message contient un chemin relatif qui existe,
-            # extract_image_sources l'aura déjà trouvé. Sinon on peut vérifier un dossier par défaut si besoin.
-            if not image_sources:
-                context["image"] = "Aucune source d'image détectée dans le message utilisateur."
-                logging.info("Aucune source d'image trouvée pour image_agent")
+def _analyse_image_sources(image_sources: List[Dict[str, str]], downloads: Dict[str, tuple]) -> Dict[str, object]:
+    images_results = []
+    batch_positions: List[int] = []
+
+    for src in image_sources:
+        src_type = src.get("type")
+        src_value = src.get("value")
+        logging.info("Traitement source: %s -> %s", src_type, src_value)
+
+        local_paths: List[str] = []
+
+        if src_type == "url":
+            dl, error = downloads[src_value]
+            if dl:
+                local_paths = [dl]
             else:
-                for src in image_sources:
-                    src_type = src.get("type")
-                    src_value = src.get("value")
-                    logging.info("Traitement source: %s -> %s", src_type, src_value)
-
-                    local_paths: List[str] = []
-
-                    if src_type == "url":
-                        dl = download_image(src_value)
-                        if dl:
-                            local_paths = [dl]
-                        else:
-                            images_results.append({"source": src_value, "error": "échec téléchargement"})
-                            continue
-
-                    elif src_type == "file":
-                        # si chemin absolu ou relatif sur machine
-                        # si path existe et est fichier ou dossier
-                        if os.path.exists(src_value):
-                            # collecte fichiers image si dossier
-                            local_paths = collect_files_from_path(src_value)
-                            if not local_paths and os.path.isfile(src_value):
-                                # peut-être extension non standard, on l'ajoute
-                                local_paths = [src_value]
-                        else:
-                            # tenter d'interpréter comme chemin windows avec backslashes
-                            alt = src_value.replace('/', os.sep).replace('\\', os.sep)
-                            if os.path.exists(alt):
-                                local_paths = collect_files_from_path(alt)
-                            else:
-                                images_results.append({"source": src_value, "error": "chemin local introuvable"})
-                                continue
-
-                    # Appel à l'image agent pour chaque fichier local
-                    for p in local_paths:
-                        try:
-                            logging.info("Appel image agent sur %s", p)
-                            res = call_image_agent(p)
-                            images_results.append({"source": p, "result": res})
-                        except Exception as e:
-                            logging.exception("Erreur appel image agent pour %s: %s", p, e)
-                            images_results.append({"source": p, "error": str(e)})
-
-                context["images"] = images_results
+                images_results.append({"source": src_value, "error": f"échec téléchargement : {error}"})
+                continue
+
+        elif src_type == "file":
+            # si chemin absolu ou relatif sur machine
+            # si path existe et est fichier ou dossier
+            if os.path.exists(src_value):
+                # collecte fichiers image si dossier
+                local_paths = collect_files_from_path(src_value)
+                if not local_paths and os.path.isfile(src_value):
+                    if IMAGE_SKIP_ANALYSED and DIRECTORY_INDEX.is_analysed(src_value):
+                        images_results.append({"source": src_value, "note": "image déjà analysée et inchangée"})
+                        continue
+                    # peut-être extension non standard, on l'ajoute
+                    local_paths = [src_value]
+            else:
+                # tenter d'interpréter comme chemin windows avec backslashes
+                alt = src_value.replace('/', os.sep).replace('\\', os.sep)
+                if os.path.exists(alt):
+                    local_paths = collect_files_from_path(alt)
+                else:
+                    images_results.append({"source": src_value, "error": "chemin local introuvable"})
+                    continue
+
+        # Les fichiers sont collectés pour toutes les sources puis analysés en un seul lot
+        for p in local_paths:
+            batch_positions.append(len(images_results))
+            images_results.append({"source": p})
+
+    batch_paths = [images_results[i]["source"] for i in batch_positions]
+    if batch_paths:
+        logging.info("Appel image agent sur %d fichier(s)", len(batch_paths))
+        for position, res in zip(batch_positions, call_image_agent_batch(batch_paths)):
+            images_results[position]["result"] = res
+
+    return {"images": images_results}
 
-        elif agent == "general":
-            context["general"] = call_general_agent(user_message)
 
+def mark_images_analysed(result: Dict[str, object]) -> None:
+    DIRECTORY_INDEX.mark_analysed(entry["source"] for entry in result.get("images", [])
+                                  if "error" not in entry and "error" not in entry.get("result", {}))
+
+
+def run_general_agent(user_message: str, image_sources: List[Dict[str, str]], upstream: Dict[str, object]) -> Dict[str, object]:
+    return {"general": call_general_agent(user_message)}
+
+
+# Exécuteurs des agents : chacun reçoit le message, les sources d'images et les résultats des agents
+# dont il dépend, et retourne les clés à fusionner dans le contexte
+AGENT_RUNNERS = {
+    "document_agent": run_document_agent,
+    "weather_agent": run_weather_agent,
+    "image_agent": run_image_agent,
+    "general": run_general_agent,
+}
+
+# Dépendances fixes entre agents (agent -> agents dont il a besoin des résultats),
+# complétées par le champ optionnel 'depends_on' des étapes du plan
+AGENT_DEPENDENCIES: Dict[str, List[str]] = {}
+
+MAX_PARALLEL_AGENTS = int(os.getenv("ORCHESTRATOR_MAX_PARALLEL_AGENTS", "4"))
+
+# Appels simultanés autorisés par agent, toutes requêtes confondues (protège les quotas des services)
+AGENT_CONCURRENCY = {
+    "document_agent": int(os.getenv("DOCUMENT_AGENT_CONCURRENCY", "8")),
+    "weather_agent": int(os.getenv("WEATHER_AGENT_CONCURRENCY", "8")),
+    "image_agent": int(os.getenv("IMAGE_AGENT_CONCURRENCY", "2")),
+    "general": int(os.getenv("GENERAL_AGENT_CONCURRENCY", "8")),
+}
+AGENT_SEMAPHORES = {agent: threading.BoundedSemaphore(limit) for agent, limit in AGENT_CONCURRENCY.items()}
+
+# Clés de contexte dont les valeurs de plusieurs agents s'accumulent
+LIST_CONTEXT_KEYS = {"other", "errors"}
+
+
+def merge_context(context: Dict[str, object], partial: Dict[str, object]) -> None:
+    for key, value in partial.items():
+        if key in LIST_CONTEXT_KEYS:
+            context.setdefault(key, []).extend(value)
         else:
-            logging.warning("Agent inconnu demandé: %s", agent)
-            context.setdefault("other", []).append({"agent": agent, "note": "agent inconnu"})
+            context[key] = value
+
+
+# Traitements appliqués au résultat d'un agent une fois retenu par execute_plan ; un résultat
+# spéculatif abandonné n'y passe jamais (ex. les images ne sont pas marquées comme analysées)
+AGENT_RESULT_HOOKS: Dict[str, Callable[[Dict[str, object]], None]] = {}
+if IMAGE_SKIP_ANALYSED:
+    # sans IMAGE_SKIP_ANALYSED, le marquage ne servirait à rien et l'index grandirait à chaque image
+    AGENT_RESULT_HOOKS["image_agent"] = mark_images_analysed
+
+
+def run_agent(step: Dict[str, str], user_message: str, image_sources: List[Dict[str, str]],
+              upstream: Dict[str, object], speculative: bool = False) -> Dict[str, object]:
+    """Exécute un agent. Une exécution spéculative tient déjà sa place dans AGENT_SEMAPHORES :
+    start_speculation l'a prise sans attendre et SpeculativeRun la rend à la fin de l'exécution."""
+    agent = step.get("agent")
+    logging.info("Step agent: %s — %s", agent, step.get("reason", ""))
+    runner = AGENT_RUNNERS.get(agent)
+    if runner is None:
+        logging.warning("Agent inconnu demandé: %s", agent)
+        return {"other": [{"agent": agent, "note": "agent inconnu"}]}
+    try:
+        semaphore = None if speculative else AGENT_SEMAPHORES.get(agent)
+        with semaphore or nullcontext():
+            return runner(user_message, image_sources, upstream)
+    except Exception as e:
+        logging.exception("Erreur de l'agent %s: %s", agent, e)
+        return {"errors": [{"agent": agent, "error": str(e)}]}
+
+
+def build_execution_graph(plan: List[Dict[str, str]]):
+    """Transforme le plan en graphe de dépendances.
+    Retourne (étapes uniques dans l'ordre du plan, {agent: agents dont il dépend})."""
+    steps: List[Dict[str, str]] = []
+    seen = set()
+    for step in plan:
+        agent = step.get("agent")
+        if agent in seen:
+            logging.info("Agent %s déjà planifié, étape ignorée", agent)
+            continue
+        seen.add(agent)
+        steps.append(step)
 
-    # Préparer le contexte structuré pour la synthèse finale
-    context_serialized = "\n".join([f"[{k.upper()}]: {v}" for k, v in context.items()])
+    dependencies = {}
+    for step in steps:
+        agent = step.get("agent")
+        wanted = list(AGENT_DEPENDENCIES.get(agent, []))
+        depends_on = step.get("depends_on") or []
+        wanted += [depends_on] if isinstance(depends_on, str) else list(depends_on)
+        dependencies[agent] = {d for d in wanted if d in seen and d != agent}
+    return steps, dependencies
+
+
+# Budget en tokens par entrée du contexte envoyé à la synthèse (hors budgets propres à context_utils)
+CONTEXT_TOKENS_PER_AGENT = int(os.getenv("ORCHESTRATOR_CONTEXT_TOKENS_PER_AGENT", "600"))
+
+# Exécution spéculative : les agents très probables (selon le routeur local) démarrent pendant detect_intents
+SPECULATIVE_EXECUTION = os.getenv("ORCHESTRATOR_SPECULATIVE", "0") == "1"
+SPECULATION_THRESHOLD = float(os.getenv("ORCHESTRATOR_SPECULATION_THRESHOLD", "0.6"))
+# seuls des agents en lecture seule, sans effet de bord, peuvent être lancés puis abandonnés
+SPECULATIVE_AGENTS = [a.strip() for a in os.getenv("ORCHESTRATOR_SPECULATIVE_AGENTS", "image_agent,weather_agent").split(",") if a.strip()]
+
+
+# Temps de calcul réellement perdu par les exécutions spéculatives abandonnées, toutes requêtes confondues
+# (une exécution abandonnée en cours n'est comptée qu'à sa fin réelle)
+_speculation_lock = threading.Lock()
+_speculation_totals = {"discarded": 0, "wasted": 0.0}
+
+
+def _record_wasted(elapsed: float) -> None:
+    with _speculation_lock:
+        _speculation_totals["discarded"] += 1
+        _speculation_totals["wasted"] += elapsed
+
+
+def speculation_stats() -> Dict[str, object]:
+    with _speculation_lock:
+        return {"discarded": _speculation_totals["discarded"], "wasted": round(_speculation_totals["wasted"], 3)}
+
+
+class SpeculativeRun:
+    """Agents lancés avant que le plan soit connu, chacun avec une place déjà prise dans AGENT_SEMAPHORES.
+    execute_plan reprend (take) ceux que le plan confirme ; finish() abandonne les autres
+    et retourne le bilan : avance prise par agent confirmé, temps de calcul perdu.
+    Une exécution abandonnée encore en cours n'est mesurée que jusqu'à finish() : le bilan la marque
+    "running" et son temps réel est ajouté à speculation_stats() quand elle se termine."""
+
+    def __init__(self, agents: List[str], user_message: str, image_sources: List[Dict[str, str]]):
+        self.started_at = time.monotonic()
+        self.plan_decided_at: Optional[float] = None
+        self.started: Dict[str, float] = {}
+        self.finished: Dict[str, float] = {}
+        self.futures = {}
+        self.adopted: List[str] = []
+        self._lock = threading.Lock()
+        self._abandoned_running = set()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(agents)), thread_name_prefix="speculative")
+        for agent in agents:
+            logging.info("Lancement spéculatif de %s", agent)
+            self.started[agent] = time.monotonic()
+            future = self.executor.submit(run_agent, {"agent": agent, "reason": "exécution spéculative"},
+                                          user_message, image_sources, {}, True)
+            future.add_done_callback(lambda f, agent=agent: self._done(agent))
+            self.futures[agent] = future
+
+    def _done(self, agent: str):
+        # appelé aussi pour une exécution annulée avant de démarrer : la place est toujours rendue
+        with self._lock:
+            self.finished.setdefault(agent, time.monotonic())
+            if agent in self._abandoned_running:
+                self._abandoned_running.discard(agent)
+                _record_wasted(self.finished[agent] - self.started[agent])
+        semaphore = AGENT_SEMAPHORES.get(agent)
+        if semaphore is not None:
+            semaphore.release()
+
+    def plan_decided(self):
+        self.plan_decided_at = time.monotonic()
+
+    def take(self, agent: str):
+        """Retourne le future de l'agent s'il a été lancé spéculativement (une seule fois), sinon None."""
+        future = self.futures.pop(agent, None)
+        if future is not None:
+            self.adopted.append(agent)
+        return future
+
+    def finish(self) -> Dict[str, object]:
+        now = time.monotonic()
+        decided = self.plan_decided_at or now
+        discarded = []
+        wasted = 0.0
+        for agent, future in self.futures.items():
+            if future.cancel():
+                discarded.append({"agent": agent, "wasted": 0.0})
+                continue
+            with self._lock:
+                running = agent not in self.finished
+                elapsed = self.finished.get(agent, now) - self.started[agent]
+                if running:
+                    # elle continue en arrière-plan, son résultat sera ignoré ; _done comptera son temps réel
+                    self._abandoned_running.add(agent)
+                else:
+                    _record_wasted(elapsed)
+            wasted += elapsed
+            entry = {"agent": agent, "wasted": round(elapsed, 3)}
+            if running:
+                entry["running"] = True
+            discarded.append(entry)
+        self.futures = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+        confirmed = []
+        for agent in self.adopted:
+            runtime = self.finished.get(agent, now) - self.started[agent]
+            saved = max(0.0, min(runtime, decided - self.started[agent]))
+            confirmed.append({"agent": agent, "saved": round(saved, 3)})
+        return {
+            "detection_time": round(decided - self.started_at, 3),
+            "confirmed": confirmed,
+            "discarded": discarded,
+            # les agents tournent en parallèle : le gain de latence est la plus grande avance prise
+            "time_saved": max((c["saved"] for c in confirmed), default=0.0),
+            # borne inférieure si une exécution abandonnée tourne encore (voir speculation_stats)
+            "wasted": round(wasted, 3),
+            "wasted_is_lower_bound": any(entry.get("running") for entry in discarded),
+        }
+
+
+def start_speculation(user_message: str, image_sources: List[Dict[str, str]],
+                      scores: Dict[str, float]) -> Optional[SpeculativeRun]:
+    """Lance les agents spéculables dont le score du routeur local atteint SPECULATION_THRESHOLD.
+    Un agent n'est lancé que si une place est libre dans son sémaphore (prise sans attendre) :
+    la spéculation ne dépasse jamais AGENT_CONCURRENCY, et y renonce quand l'agent est saturé."""
+    if not SPECULATIVE_EXECUTION:
+        return None
+    agents = []
+    for agent in SPECULATIVE_AGENTS:
+        if scores.get(agent, 0.0) < SPECULATION_THRESHOLD or AGENT_DEPENDENCIES.get(agent):
+            continue
+        semaphore = AGENT_SEMAPHORES.get(agent)
+        if semaphore is not None and not semaphore.acquire(blocking=False):
+            logging.info("Pas de place libre pour %s, pas d'exécution spéculative", agent)
+            continue
+        agents.append(agent)
+    return SpeculativeRun(agents, user_message, image_sources) if agents else None
+
+
+def execute_plan(plan: List[Dict[str, str]], user_message: str, image_sources: List[Dict[str, str]],
+                 max_workers: int = MAX_PARALLEL_AGENTS,
+                 on_event: Optional[Callable[[Dict[str, object]], None]] = None,
+                 speculative: Optional[SpeculativeRun] = None) -> Dict[str, object]:
+    """Exécute les agents du plan en parallèle (au plus max_workers à la fois).
+    Un agent démarre dès que les agents dont il dépend ont terminé ; les résultats sont
+    fusionnés dans le contexte dans l'ordre du plan, quel que soit l'ordre de fin.
+    Si on_event est fourni, il reçoit les événements agent_started / agent_finished.
+    Les agents sans dépendance déjà lancés par `speculative` ne sont pas relancés."""
+    emit = on_event or (lambda event: None)
+    steps, dependencies = build_execution_graph(plan)
+    order = [step.get("agent") for step in steps]
+    by_agent = {step.get("agent"): step for step in steps}
+    results: Dict[str, Dict[str, object]] = {}
+    started: Dict[str, float] = {}
+    waiting = dict(dependencies)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        running = {}
+        while waiting or running:
+            ready = [agent for agent in order if agent in waiting and waiting[agent] <= results.keys()]
+            if not ready and not running:
+                # dépendance circulaire : on débloque le premier agent restant dans l'ordre du plan
+                agent = next(agent for agent in order if agent in waiting)
+                logging.warning("Dépendance circulaire autour de %s, exécution sans ses dépendances", agent)
+                ready = [agent]
+            for agent in ready:
+                upstream: Dict[str, object] = {}
+                for dependency in order:
+                    if dependency in dependencies[agent] and dependency in results:
+                        merge_context(upstream, results[dependency])
+                # un résultat spéculatif n'est valable que pour un agent sans dépendance (lancé sans upstream)
+                future = speculative.take(agent) if speculative is not None and not dependencies[agent] else None
+                adopted = future is not None
+                if adopted:
+                    started[agent] = speculative.started[agent]
+                else:
+                    future = executor.submit(run_agent, by_agent[agent], user_message, image_sources, upstream)
+                    started[agent] = time.monotonic()
+                running[future] = agent
+                del waiting[agent]
+                emit({"type": "agent_started", "agent": agent, "reason": by_agent[agent].get("reason", ""),
+                      "speculative": adopted})
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                agent = running.pop(future)
+                results[agent] = future.result()
+                hook = AGENT_RESULT_HOOKS.get(agent)
+                if hook is not None:
+                    try:
+                        hook(results[agent])
+                    except Exception as e:
+                        logging.exception("Erreur du post-traitement de %s: %s", agent, e)
+                emit({"type": "agent_finished", "agent": agent, "result": results[agent],
+                      "elapsed": round(time.monotonic() - started[agent], 3)})
 
-    final_answer = FINAL_CHAIN.run({"context": context_serialized, "user_message": user_message})
+    context: Dict[str, object] = {}
+    for agent in order:
+        merge_context(context, results[agent])
+    return context
+
+
+def orchestrate_events(user_message: str) -> Iterator[Dict[str, object]]:
+    """Version streaming d'orchestrate : génère des événements typés au fil de l'exécution.
+
+    - {"type": "plan", "plan": [...]} dès que le plan est décidé ;
+    - {"type": "agent_started", "agent", "reason"} puis {"type": "agent_finished", "agent", "result", "elapsed"} ;
+    - {"type": "token", "content"} pour chaque fragment de la réponse finale ;
+    - {"type": "final", "plan", "context", "final_answer"} en dernier."""
+    image_sources = extract_image_sources(user_message)
+    logging.info("Sources d'images détectées: %s", image_sources)
+
+    # scores du routeur calculés une seule fois (un appel d'embeddings possible) pour la spéculation et le plan
+    scores = INTENT_ROUTER.score(user_message, image_sources)
+    speculation = start_speculation(user_message, image_sources, scores)
+    try:
+        plan = detect_intents(user_message, image_sources, scores)
+    except BaseException:
+        if speculation is not None:
+            speculation.finish()
+        raise
+    if speculation is not None:
+        speculation.plan_decided()
+    yield {"type": "plan", "plan": plan}
+
+    # Les agents tournent dans un thread ; leurs événements remontent par une file
+    events: "queue.Queue[Dict[str, object]]" = queue.Queue()
+    outcome: Dict[str, object] = {}
+
+    def run():
+        try:
+            outcome["context"] = execute_plan(plan, user_message, image_sources, on_event=events.put,
+                                              speculative=speculation)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            if speculation is not None:
+                outcome["speculation"] = speculation.finish()
+            events.put(None)
+
+    worker = threading.Thread(target=run, name="orchestrate-agents", daemon=True)
+    worker.start()
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # un consommateur qui ferme le générateur en cours de route (client déconnecté) attend la fin
+        # des agents : le travail en cours reste compté tant qu'il tourne réellement
+        worker.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    context = outcome["context"]
+
+    # Préparer le contexte pour la synthèse finale : résultats projetés et bornés en tokens par agent
+    context_serialized = serialize_context(context, default_budget=CONTEXT_TOKENS_PER_AGENT)
+    parts: List[str] = []
+    for chunk in LLM.stream(FINAL_PROMPT.format(context=context_serialized, user_message=user_message)):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield {"type": "token", "content": chunk.content}
+
+    final = {"type": "final", "plan": plan, "context": context, "final_answer": "".join(parts)}
+    if speculation is not None:
+        final["speculation"] = outcome["speculation"]
+    yield final
+
+
+def orchestrate(user_message: str, stream: bool = False):
+    """Orchestre les appels aux agents et renvoie un dict structuré de résultats.
+
+    - Prend en charge plusieurs images trouvées dans le message.
+    - Supporte URLs, fichiers locaux et dossiers locaux (ex: C:/images ou /home/user/images).
+    - Les agents indépendants du plan s'exécutent en parallèle (voir execute_plan).
+    - Retourne la liste des résultats d'analyse image dans context['images'].
+    - Avec stream=True, retourne le générateur d'événements d'orchestrate_events."""
+    if stream:
+        return orchestrate_events(user_message)
 
-    return {"plan": plan, "context": context, "final_answer": final_answer}
+    # Même pipeline que le mode streaming : on ne garde que l'événement final
+    final = None
+    for event in orchestrate_events(user_message):
+        if event["type"] == "final":
+            final = event
+    return {key: value for key, value in final.items() if key != "type"}
 
 
 if __name__ == "__main__":
     msg = input("Message: ")
-    result = orchestrate(msg)
+    result = None
+    for event in orchestrate(msg, stream=True):
+        if event["type"] == "plan":
+            print("Plan :", ", ".join(step.get("agent", "?") for step in event["plan"]))
+        elif event["type"] == "agent_started":
+            print(f"  -> {event['agent']} démarré")
+        elif event["type"] == "agent_finished":
+            print(f"  <- {event['agent']} terminé en {event['elapsed']:.2f} s")
+        elif event["type"] == "token":
+            print(event["content"], end="", flush=True)
+        elif event["type"] == "final":
+            result = event
     print("\n\n--- RÉSULTAT STRUCTURÉ ---\n")
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(json.dumps({k: v for k, v in result.items() if k != "type"}, ensure_ascii=False, indent=2))
 
 
 
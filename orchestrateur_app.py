@@ -0,0 +1,137 @@
+import os
+import json
+import logging
+import threading
+
+from flask import Flask, request, jsonify, Response, stream_with_context
+
+# L'import crée une seule fois les clients (LLM, Custom Vision, routeur, caches) partagés par toutes les requêtes
+import orchestrateur
+from orchestrateur import orchestrate, orchestrate_events, get_image_downloader, INTENT_ROUTER, PLAN_CACHE
+
+
+app = Flask(__name__)
+
+# Requêtes d'orchestration simultanées ; au-delà, attente courte puis 503 avec Retry-After
+MAX_CONCURRENT_REQUESTS = int(os.getenv("ORCHESTRATOR_MAX_CONCURRENT_REQUESTS", "8"))
+QUEUE_TIMEOUT = float(os.getenv("ORCHESTRATOR_QUEUE_TIMEOUT", "2"))
+RETRY_AFTER_SECONDS = int(os.getenv("ORCHESTRATOR_RETRY_AFTER", "5"))
+
+REQUEST_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+_active_lock = threading.Lock()
+_active_requests = 0
+_rejected_requests = 0
+
+
+def warm_up():
+    """Initialise les clients paresseux pour que la première requête ne paie pas leur création."""
+    # agent_weather n'est pas importé : run_weather_agent est encore simulé, et l'import du module
+    # déclenche des appels Azure Maps
+    get_image_downloader()
+    search_index = os.getenv("AZURE_SEARCH_INDEX")
+    if search_index:
+        try:
+            from utils.search_utils import get_search_client
+            get_search_client(search_index)
+        except Exception as e:
+            logging.warning("Client de recherche non initialisé : %s", e)
+
+
+def _acquire_slot() -> bool:
+    global _active_requests, _rejected_requests
+    if not REQUEST_SLOTS.acquire(timeout=QUEUE_TIMEOUT):
+        with _active_lock:
+            _rejected_requests += 1
+        return False
+    with _active_lock:
+        _active_requests += 1
+    return True
+
+
+def _release_slot():
+    global _active_requests
+    with _active_lock:
+        _active_requests -= 1
+    REQUEST_SLOTS.release()
+
+
+def _saturated():
+    response = jsonify({"error": "Service saturé, réessayez plus tard."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+
+def _read_message():
+    data = request.get_json(silent=True) or {}
+    return (data.get("message") or "").strip()
+
+
+@app.route('/orchestrate', methods=['POST'])
+def orchestrate_route():
+    message = _read_message()
+    if not message:
+        return jsonify({"error": "Le champ 'message' est obligatoire."}), 400
+    if not _acquire_slot():
+        return _saturated()
+    try:
+        return jsonify(orchestrate(message))
+    except Exception as e:
+        logging.exception("Erreur d'orchestration: %s", e)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        _release_slot()
+
+
+@app.route('/orchestrate/stream', methods=['POST'])
+def orchestrate_stream_route():
+    """Flux NDJSON : un événement d'orchestrate_events par ligne."""
+    message = _read_message()
+    if not message:
+        return jsonify({"error": "Le champ 'message' est obligatoire."}), 400
+    if not _acquire_slot():
+        return _saturated()
+
+    released = []
+
+    def release_once():
+        if not released:
+            released.append(True)
+            _release_slot()
+
+    def generate():
+        try:
+            for event in orchestrate_events(message):
+                yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        except Exception as e:
+            logging.exception("Erreur d'orchestration: %s", e)
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            release_once()
+
+    # le créneau est libéré à la fin du flux, ou à la fermeture de la réponse si le flux n'a pas démarré ;
+    # si le client se déconnecte, la fermeture du générateur attend la fin des agents avant de le libérer
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.call_on_close(release_once)
+    return response
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    with _active_lock:
+        active, rejected = _active_requests, _rejected_requests
+    return jsonify({
+        "active_requests": active,
+        "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+        "rejected_requests": rejected,
+        "router": INTENT_ROUTER.stats(),
+        "plan_cache": PLAN_CACHE.stats(),
+        "downloads": get_image_downloader().stats(),
+        "agent_concurrency": orchestrateur.AGENT_CONCURRENCY,
+        "speculation": orchestrateur.speculation_stats(),
+    })
+
+
+if __name__ == '__main__':
+    warm_up()
+    app.run(host='0.0.0.0', port=int(os.getenv("ORCHESTRATOR_PORT", "5001")), threaded=True)
@@ -0,0 +1,134 @@
+# utils/context_utils.py
+import json
+import logging
+from collections import Counter, defaultdict
+
+from utils.conversation_utils import truncate_to_tokens
+
+# token budget of each context entry in the synthesis prompt
+DEFAULT_TOKEN_BUDGET = 600
+TOKEN_BUDGETS = {
+    "document": 1200,
+    "images": 800,
+    "weather": 500,
+}
+TOP_K_IMAGES = 5
+TOP_K_PREDICTIONS = 3
+MAX_ERRORS_LISTED = 3
+# rough characters per token, used when tiktoken's encoding cannot be loaded (no network and no cached file)
+CHARS_PER_TOKEN = 4
+
+_encoding_available = True
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _truncate(text: str, budget: int) -> str:
+    global _encoding_available
+    if _encoding_available:
+        try:
+            return truncate_to_tokens(text, budget, keep="start")
+        except Exception as e:
+            # not retried: loading the encoding would be attempted again for every entry of every request
+            _encoding_available = False
+            logging.warning("Token encoding unavailable, truncating by characters: %s", e)
+    return text[:budget * CHARS_PER_TOKEN]
+
+
+def _ranked_predictions(result: dict) -> list:
+    predictions = result.get("predictions") or []
+    return sorted(predictions, key=lambda p: p.get("probability", 0), reverse=True)
+
+
+def summarize_images(entries: list, top_k: int = TOP_K_IMAGES) -> dict:
+    """
+    Aggregates per-image predictions: image and error counts, how many images have each class as
+    their top prediction (with its mean probability), and the `top_k` most confident images.
+    A single image keeps its best predictions.
+    """
+    analysed = []
+    errors = []
+    for entry in entries:
+        result = entry.get("result") or {}
+        error = entry.get("error") or result.get("error")
+        if error:
+            errors.append({"source": entry.get("source"), "error": error})
+            continue
+        predictions = _ranked_predictions(result)
+        if predictions:
+            analysed.append((result.get("image") or entry.get("source"), predictions))
+
+    summary = {"images": len(entries), "analysed": len(analysed), "errors": len(errors)}
+    if len(analysed) == 1 and not errors:
+        image, predictions = analysed[0]
+        summary["image"] = image
+        summary["predictions"] = predictions[:TOP_K_PREDICTIONS]
+        return summary
+
+    counts = Counter()
+    probabilities = defaultdict(list)
+    for _, predictions in analysed:
+        tag = predictions[0].get("tag_name")
+        counts[tag] += 1
+        probabilities[tag].append(predictions[0].get("probability", 0))
+    summary["classes"] = [
+        {"tag_name": tag, "images": count,
+         "mean_probability": round(sum(probabilities[tag]) / len(probabilities[tag]), 2)}
+        for tag, count in counts.most_common()
+    ]
+    ranked = sorted(analysed, key=lambda item: item[1][0].get("probability", 0), reverse=True)
+    summary["top_images"] = [
+        {"image": image, "tag_name": predictions[0].get("tag_name"),
+         "probability": predictions[0].get("probability")}
+        for image, predictions in ranked[:top_k]
+    ]
+    if errors:
+        summary["error_samples"] = errors[:MAX_ERRORS_LISTED]
+    return summary
+
+
+def project_weather(value):
+    """
+    Keeps the summary of a weather result and drops the raw forecast payload.
+    """
+    if not isinstance(value, dict):
+        return value
+    projected = {key: value[key] for key in ("summary", "coords", "error") if value.get(key)}
+    if "summary" not in projected and value.get("forecast_raw"):
+        # no summary was produced: fall back to the raw forecast, bounded by the token budget
+        projected["forecast"] = value["forecast_raw"]
+    return projected
+
+
+def project_errors(entries: list) -> list:
+    return [{"agent": entry.get("agent"), "error": entry.get("error")} for entry in entries]
+
+
+PROJECTIONS = {
+    "images": summarize_images,
+    "weather": project_weather,
+    "errors": project_errors,
+}
+
+
+def serialize_context(context: dict, budgets: dict = None, default_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """
+    Serializes the agents' results for the synthesis prompt, one "[KEY]: value" line per entry.
+    Each value is projected to what the synthesis needs, rendered as compact JSON (strings as is)
+    and truncated to its token budget (approximated in characters when the encoding is unavailable).
+    """
+    budgets = {**TOKEN_BUDGETS, **(budgets or {})}
+    lines = []
+    for key, value in context.items():
+        projection = PROJECTIONS.get(key)
+        if projection is not None:
+            value = projection(value)
+        text = value if isinstance(value, str) else _dumps(value)
+        budget = budgets.get(key, default_budget)
+        truncated = _truncate(text, budget)
+        if truncated != text:
+            truncated += " ... (truncated)"
+        lines.append(f"[{key.upper()}]: {truncated}")
+    return "\n".join(lines)
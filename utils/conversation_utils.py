@@ -0,0 +1,146 @@
+# utils/conversation_utils.py
+import tiktoken
+
+# tokens added by the chat format around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# share of the budget left after a compaction
+COMPACTION_TARGET = 0.75
+
+
+def _encoding():
+    return tiktoken.get_encoding(encoding_name="cl100k_base")
+
+
+def count_message_tokens(message: dict) -> int:
+    return len(_encoding().encode(message["content"] or "", disallowed_special=())) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "end") -> str:
+    """
+    Truncates a text to at most `max_tokens` tokens, keeping its end (most recent content) or its start.
+    """
+    encoding = _encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    kept = tokens[-max_tokens:] if keep == "end" else tokens[:max_tokens]
+    return encoding.decode(kept)
+
+
+def summarize_extractively(summary: str, turns: list, max_tokens: int) -> str:
+    """
+    Fallback summarizer: appends the dropped turns to the summary and keeps its most recent part.
+    """
+    lines = [summary] if summary else []
+    for turn in turns:
+        for message in turn:
+            lines.append(f"{message['role']}: {message['content']}")
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+class ConversationMemory:
+    """
+    Token-budgeted history for a chat loop.
+
+    - the system prompt is always sent;
+    - context messages are keyed: setting the same key again replaces the previous content,
+      and content already sent under another key is not repeated;
+    - the most recent turns are kept while they fit in `max_tokens`, older turns are folded into a
+      rolling summary by `summarizer(summary, turns, max_tokens)`, an extractive one by default.
+
+    `last_usage` holds the token accounting of the last prompt built, `usage_log` one entry per turn.
+    """
+
+    def __init__(self, system_prompt: str, max_tokens: int = 3000, summary_max_tokens: int = 300,
+                 summarizer=None):
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer or summarize_extractively
+        self._system = self._entry({"role": "system", "content": system_prompt})
+        self._context = {}
+        self._summary = None
+        self._summary_text = ""
+        self._turns = []
+        self.summarized_turns = 0
+        self.last_usage = None
+        self.usage_log = []
+
+    @staticmethod
+    def _entry(message: dict) -> tuple:
+        return message, count_message_tokens(message)
+
+    def set_context(self, key: str, content: str):
+        if not content:
+            self._context.pop(key, None)
+            return
+        if any(message["content"] == content for k, (message, _) in self._context.items() if k != key):
+            return
+        self._context[key] = self._entry({"role": "system", "content": content})
+
+    def add_user(self, content: str):
+        self._turns.append([self._entry({"role": "user", "content": content})])
+
+    def add_assistant(self, content: str):
+        entry = self._entry({"role": "assistant", "content": content})
+        if self._turns and self._turns[-1][-1][0]["role"] == "user":
+            self._turns[-1].append(entry)
+        else:
+            self._turns.append([entry])
+
+    @property
+    def summary(self) -> str:
+        return self._summary_text
+
+    def _fixed_tokens(self) -> int:
+        tokens = self._system[1] + sum(t for _, t in self._context.values())
+        return tokens + (self._summary[1] if self._summary else 0)
+
+    def _turn_tokens(self, turn) -> int:
+        return sum(t for _, t in turn)
+
+    def _compact(self):
+        history = sum(self._turn_tokens(turn) for turn in self._turns)
+        if self._fixed_tokens() + history <= self.max_tokens:
+            return
+        # compact down to a lower watermark so the summarizer does not run on every turn,
+        # the last turn (the pending question) is always kept
+        target = int(self.max_tokens * COMPACTION_TARGET) - self.summary_max_tokens
+        dropped = []
+        while len(self._turns) > 1 and self._fixed_tokens() + history > target:
+            turn = self._turns.pop(0)
+            history -= self._turn_tokens(turn)
+            dropped.append(turn)
+        if not dropped:
+            return
+        messages = [[message for message, _ in turn] for turn in dropped]
+        self._summary_text = self.summarizer(self._summary_text, messages, self.summary_max_tokens) or ""
+        content = f"Summary of the earlier conversation:\n{self._summary_text}"
+        self._summary = self._entry({"role": "system", "content": content}) if self._summary_text else None
+        self.summarized_turns += len(dropped)
+        # the new summary may itself push the prompt over budget
+        if self._summary and len(self._turns) > 1 and \
+                self._fixed_tokens() + sum(self._turn_tokens(turn) for turn in self._turns) > self.max_tokens:
+            self._compact()
+
+    def messages(self) -> list:
+        """
+        Builds the message list to send, compacting older turns first if the budget is exceeded.
+        """
+        self._compact()
+        entries = [self._system] + list(self._context.values())
+        if self._summary:
+            entries.append(self._summary)
+        history = [entry for turn in self._turns for entry in turn]
+
+        usage = {
+            "system": self._system[1],
+            "context": sum(t for _, t in self._context.values()),
+            "summary": self._summary[1] if self._summary else 0,
+            "history": sum(t for _, t in history),
+            "turns_in_window": len(self._turns),
+            "turns_summarized": self.summarized_turns,
+        }
+        usage["total"] = usage["system"] + usage["context"] + usage["summary"] + usage["history"]
+        self.last_usage = usage
+        self.usage_log.append(usage)
+        return [message for message, _ in entries + history]
@@ -0,0 +1,126 @@
+# utils/directory_index_utils.py
+import os
+import logging
+import threading
+
+
+class DirectoryIndex:
+    """
+    Cached, incremental index of the files under directory trees.
+
+    Each directory listing is built with os.scandir and cached with the directory's mtime, so a
+    repeated scan only stats the directories and re-lists those whose entries changed.
+    iter_files() yields files lazily, depth first in name order, and stops at `limit`.
+
+    Files can be marked as analysed; a file stays analysed until its size or mtime change.
+    """
+
+    def __init__(self, extensions=None):
+        self.extensions = {ext.lower() for ext in extensions} if extensions else None
+        self._listings = {}
+        self._analysed = {}
+        self._lock = threading.Lock()
+        self.rescans = 0
+        self.cache_hits = 0
+
+    def _matches(self, name: str) -> bool:
+        return self.extensions is None or os.path.splitext(name)[1].lower() in self.extensions
+
+    def _listing(self, directory: str):
+        """
+        Returns the sorted (file names, subdirectory names) of a directory.
+        """
+        mtime = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(directory)
+            if cached is not None and cached[0] == mtime:
+                self.cache_hits += 1
+                return cached[1], cached[2]
+
+        files, subdirs = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif self._matches(entry.name) and entry.is_file():
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        files.sort()
+        subdirs.sort()
+        with self._lock:
+            self._listings[directory] = (mtime, files, subdirs)
+            self.rescans += 1
+        return files, subdirs
+
+    def iter_files(self, path: str, limit: int = None, skip_analysed: bool = False):
+        """
+        Yields the matching files under `path` (or `path` itself when it is a matching file).
+        """
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            if self._matches(path) and not (skip_analysed and self.is_analysed(path)):
+                yield path
+            return
+
+        count = 0
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                files, subdirs = self._listing(directory)
+            except OSError as e:
+                logging.warning("Cannot list %s: %s", directory, e)
+                continue
+            for name in files:
+                file_path = os.path.join(directory, name)
+                # editing a file in place does not change its directory's mtime: re-stat analysed files
+                if skip_analysed and file_path in self._analysed and self.is_analysed(file_path):
+                    continue
+                yield file_path
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+            stack.extend(os.path.join(directory, name) for name in reversed(subdirs))
+
+    def mark_analysed(self, paths):
+        for file_path in paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            with self._lock:
+                self._analysed[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns)
+
+    def is_analysed(self, file_path: str) -> bool:
+        file_path = os.path.abspath(file_path)
+        signature = self._analysed.get(file_path)
+        if signature is None:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return signature == (stat.st_size, stat.st_mtime_ns)
+
+    def invalidate(self, path: str = None):
+        """
+        Drops the cached listings under `path`, or all of them.
+        """
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+                return
+            prefix = os.path.join(os.path.abspath(path), "")
+            for directory in [d for d in self._listings if d == prefix[:-1] or d.startswith(prefix)]:
+                del self._listings[directory]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directories": len(self._listings),
+                "rescans": self.rescans,
+                "cache_hits": self.cache_hits,
+                "analysed": len(self._analysed),
+            }
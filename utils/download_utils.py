@@ -0,0 +1,223 @@
+# utils/download_utils.py
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.cache_utils import TTLCache
+
+DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "image_downloads"))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv("DOWNLOAD_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+# (connect, read) timeouts in seconds
+DOWNLOAD_TIMEOUT = (5, 30)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# how long a URL keeps pointing to the content downloaded for it
+URL_CACHE_TTL = 3600
+
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/webp": ".webp",
+    "image/tiff": ".tiff",
+}
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ImageDownloader:
+    """
+    Downloads images through a pooled HTTP session into a content-addressed local cache.
+
+    - responses are streamed to disk and rejected when their content type is not allowed
+      or their size exceeds `max_bytes`;
+    - files are named after the sha256 of their content, so the same image reached through
+      different URLs is stored once, and a URL seen recently is served without any request;
+    - the cache is evicted in least-recently-used order once it holds more than `max_cache_bytes`;
+      files downloaded with `pin=True` are never evicted until they are released.
+    """
+
+    def __init__(self, cache_dir: str = DOWNLOAD_CACHE_DIR, max_cache_bytes: int = DOWNLOAD_CACHE_MAX_BYTES,
+                 max_bytes: int = DOWNLOAD_MAX_BYTES, timeout=DOWNLOAD_TIMEOUT, content_types: dict = None,
+                 max_workers: int = DOWNLOAD_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.content_types = content_types or IMAGE_CONTENT_TYPES
+        self.max_workers = max_workers
+
+        self.session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._urls = TTLCache(maxsize=4096, ttl=URL_CACHE_TTL)
+        self._files = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # url -> [lock, number of threads using it], removed when no thread uses it anymore
+        self._url_locks = {}
+        # path -> number of pins, pinned files are skipped by eviction
+        self._pins = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_cache_dir()
+
+    def _load_cache_dir(self):
+        """
+        Registers the files left by a previous run, oldest access first.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".part"):
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_atime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _touch(self, path: str, pin: bool = False) -> bool:
+        with self._lock:
+            if path not in self._files or not os.path.exists(path):
+                return False
+            self._files.move_to_end(path)
+            if pin:
+                self._pins[path] = self._pins.get(path, 0) + 1
+        return True
+
+    def _register(self, path: str, size: int, pin: bool = False):
+        # pinned under the same lock as the eviction, so another thread cannot remove it in between
+        with self._lock:
+            if path not in self._files:
+                self._files[path] = size
+                self._total_bytes += size
+            self._files.move_to_end(path)
+            if pin:
+                self._pins[path] = self._pins.get(path, 0) + 1
+            self._evict(keep=path)
+
+    def _evict(self, keep: str = None):
+        if self._total_bytes <= self.max_cache_bytes:
+            return
+        for path in list(self._files):
+            if self._total_bytes <= self.max_cache_bytes:
+                break
+            if path == keep or self._pins.get(path):
+                continue
+            self._total_bytes -= self._files.pop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def release(self, path: str):
+        """
+        Releases a file returned with `pin=True`, making it evictable again.
+        """
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+                self._evict()
+
+    def _fetch(self, url: str, pin: bool = False) -> str:
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type not in self.content_types:
+                raise DownloadError(f"unsupported content type '{content_type}' for {url}")
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                raise DownloadError(f"{url} is {length} bytes, more than the {self.max_bytes} bytes allowed")
+
+            digest = hashlib.sha256()
+            size = 0
+            fd, part_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise DownloadError(f"{url} exceeds the {self.max_bytes} bytes allowed")
+                        digest.update(chunk)
+                        file.write(chunk)
+                path = os.path.join(self.cache_dir, digest.hexdigest() + self.content_types[content_type])
+                os.replace(part_path, path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+        self._register(path, size, pin)
+        return path
+
+    def download(self, url: str, pin: bool = False) -> str:
+        """
+        Returns the local path of the image at `url`, downloading it unless it is cached.
+        With `pin=True` the file is kept out of eviction until release(path) is called.
+        Raises DownloadError or requests.RequestException on failure.
+        """
+        with self._lock:
+            entry = self._url_locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            # concurrent requests for the same URL wait for a single download
+            with entry[0]:
+                path = self._urls.get(url)
+                if path is None or not self._touch(path, pin):
+                    path = self._fetch(url, pin)
+                    self._urls.set(url, path)
+                    logging.info("Image downloaded: %s -> %s", url, path)
+                return path
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._url_locks[url]
+
+    def download_many(self, urls: list, max_workers: int = None, pin: bool = False) -> list:
+        """
+        Downloads several URLs concurrently.
+        Returns one (path, error) tuple per URL, in input order; exactly one of the two is None.
+        """
+        def task(url):
+            try:
+                return self.download(url, pin=pin), None
+            except Exception as e:
+                logging.warning("Download failed for %s: %s", url, e)
+                return None, str(e)
+
+        urls = list(urls)
+        if len(urls) <= 1:
+            return [task(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(max_workers or self.max_workers, len(urls))) as executor:
+            return list(executor.map(task, urls))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._files), "bytes": self._total_bytes, "urls": self._urls.stats()}
+
+    def close(self):
+        self.session.close()
@@ -1,6 +1,7 @@
 # utils/embeddings_utils.py
 import os
 import uuid
+from functools import lru_cache
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 from azure.core.credentials import AzureKeyCredential
@@ -11,17 +12,37 @@ api_key = os.getenv("AZURE_AI_KEY")
 endpoint = os.getenv("AZURE_AI_ENDPOINT_EMBEDDINGS")
 embeddings_model_deployment = os.getenv("AZURE_AI_EMBEDDINGS_MODEL_DEPLOYMENT")
 
-def get_embedding(text: str) -> list[float]:
-    client = AzureOpenAI(
+# Azure OpenAI accepts at most 2048 inputs per embeddings request
+EMBEDDINGS_BATCH_SIZE = 2048
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    return AzureOpenAI(
         api_key=api_key,
         azure_endpoint=endpoint,
         api_version="2024-12-01-preview"
     )
-    response = client.embeddings.create(
+
+def get_embedding(text: str) -> list[float]:
+    response = get_openai_client().embeddings.create(
         input=[text],
         model=embeddings_model_deployment
     )
     return response.data[0].embedding
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embeds several texts with one request per EMBEDDINGS_BATCH_SIZE inputs, preserving the input order.
+    """
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDINGS_BATCH_SIZE):
+        response = get_openai_client().embeddings.create(
+            input=texts[start:start + EMBEDDINGS_BATCH_SIZE],
+            model=embeddings_model_deployment
+        )
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return embeddings
+
 def get_client():
     client = EmbeddingsClient(
         endpoint=endpoint,
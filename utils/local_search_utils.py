@@ -0,0 +1,360 @@
+# utils/local_search_utils.py
+import os
+import re
+import json
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+LOCAL_SEARCH_DIR = os.getenv("LOCAL_SEARCH_DIR", "local_search")
+DEFAULT_INDEX_NAME = "default"
+KEY_FIELD = "id"
+# vector fields written by search_utils (index_documents) and embeddings_utils (get_chunk_object)
+VECTOR_FIELDS = {"content_vector", "vector"}
+DEFAULT_TOP = 50
+
+# BM25 parameters, same defaults as Azure AI Search
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+FILTER_CLAUSE_REGEX = re.compile(r"^\s*(\w+)\s+(eq|ne)\s+(?:'((?:[^']|'')*)'|(\S+))\s*$", re.IGNORECASE)
+
+# same attributes as azure.search.documents.models.IndexingResult
+IndexingResult = namedtuple("IndexingResult", ["key", "succeeded", "status_code", "error_message"])
+IndexInfo = namedtuple("IndexInfo", ["name"])
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_REGEX.findall(text.lower())
+
+
+def _parse_filter(expression: str):
+    """
+    Supports the OData subset used by this project: `field eq 'value'` / `field ne value` clauses joined by `and`.
+    """
+    if not expression:
+        return None
+    clauses = []
+    for clause in re.split(r"\s+and\s+", expression.strip(), flags=re.IGNORECASE):
+        m = FILTER_CLAUSE_REGEX.match(clause)
+        if not m:
+            raise ValueError(f"Unsupported filter clause for the local search backend: {clause}")
+        field, operator, quoted, raw = m.groups()
+        if quoted is not None:
+            value = quoted.replace("''", "'")
+        elif raw.lower() in ("true", "false"):
+            value = raw.lower() == "true"
+        elif raw.lower() == "null":
+            value = None
+        else:
+            value = float(raw) if "." in raw else int(raw)
+        clauses.append((field, operator.lower(), value))
+
+    def predicate(doc):
+        for field, operator, value in clauses:
+            if (doc.get(field) == value) != (operator == "eq"):
+                return False
+        return True
+    return predicate
+
+
+class LocalSearchIndex:
+    """
+    One index stored on disk in its own directory:
+    - documents.jsonl: append-only log of {"row", "doc"} records, the last record of a key wins;
+    - vectors_<field>.f32: one L2-normalized float32 row per record, read through np.memmap;
+    - meta.json: vector dimensions.
+    Keyword search uses an in-memory BM25 inverted index rebuilt when the index is opened.
+    """
+
+    def __init__(self, name: str, directory: str = LOCAL_SEARCH_DIR, vector_fields=VECTOR_FIELDS):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.vector_fields = set(vector_fields)
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        self._documents = {}
+        self._rows = {}
+        self._row_count = 0
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._dimensions = {}
+        self._vectors = {}
+
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self._dimensions = json.load(f).get("dimensions", {})
+
+        documents_path = os.path.join(self.path, "documents.jsonl")
+        if os.path.exists(documents_path):
+            with open(documents_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._add(record["row"], record["doc"])
+                        self._row_count = max(self._row_count, record["row"] + 1)
+
+        for field in self._dimensions:
+            self._map_vectors(field)
+
+    def _vectors_path(self, field: str) -> str:
+        return os.path.join(self.path, f"vectors_{field}.f32")
+
+    def _map_vectors(self, field: str):
+        path = self._vectors_path(field)
+        dimensions = self._dimensions[field]
+        rows = os.path.getsize(path) // (4 * dimensions) if os.path.exists(path) else 0
+        if rows:
+            self._vectors[field] = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dimensions))
+        else:
+            self._vectors[field] = np.zeros((0, dimensions), dtype=np.float32)
+
+    def _add(self, row: int, doc: dict):
+        key = str(doc[KEY_FIELD])
+        if key in self._rows:
+            self._remove(key)
+        self._documents[key] = doc
+        self._rows[key] = row
+        text = " ".join(str(v) for f, v in doc.items() if f != KEY_FIELD and isinstance(v, str))
+        tokens = tokenize(text)
+        self._lengths[row] = len(tokens)
+        self._total_length += len(tokens)
+        for token in tokens:
+            postings = self._postings.setdefault(token, {})
+            postings[row] = postings.get(row, 0) + 1
+
+    def _remove(self, key: str):
+        row = self._rows.pop(key)
+        doc = self._documents.pop(key)
+        text = " ".join(str(v) for f, v in doc.items() if f != KEY_FIELD and isinstance(v, str))
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(row, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._lengths.pop(row, 0)
+
+    def clear(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            # release the memory maps first, Windows refuses to delete mapped files
+            self._vectors = {}
+            for filename in os.listdir(self.path):
+                os.remove(os.path.join(self.path, filename))
+            self._load()
+
+    def _vector_error(self, vectors: dict):
+        for field, value in vectors.items():
+            if not isinstance(value, list) or not value or not all(isinstance(x, (int, float)) for x in value):
+                return f"Field '{field}' is not a non-empty list of numbers"
+            if field in self._dimensions and len(value) != self._dimensions[field]:
+                return f"Field '{field}' has {len(value)} dimensions, expected {self._dimensions[field]}"
+        return None
+
+    def upload_documents(self, documents: list) -> list:
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            results = []
+            records = []
+            vector_rows = {}
+            for doc in documents:
+                key = str(doc.get(KEY_FIELD, ""))
+                if not key:
+                    results.append(IndexingResult(key, False, 400, f"Document is missing its '{KEY_FIELD}' key"))
+                    continue
+                plain = {}
+                vectors = {}
+                for field, value in doc.items():
+                    if field.startswith("@search."):
+                        continue
+                    if field in self.vector_fields and value is not None:
+                        vectors[field] = value
+                    else:
+                        plain[field] = value
+                error = self._vector_error(vectors)
+                if error:
+                    results.append(IndexingResult(key, False, 400, error))
+                    continue
+                for field, value in vectors.items():
+                    self._dimensions.setdefault(field, len(value))
+                records.append((plain, vectors))
+                results.append(IndexingResult(key, True, 201, None))
+
+            if not records:
+                return results
+
+            first_row = self._row_count
+            for field, dimensions in self._dimensions.items():
+                # rows written before this field existed stay at zero, which never matches
+                existing = os.path.getsize(self._vectors_path(field)) // (4 * dimensions) \
+                    if os.path.exists(self._vectors_path(field)) else 0
+                matrix = np.zeros((first_row - existing + len(records), dimensions), dtype=np.float32)
+                offset = first_row - existing
+                for i, (_, vectors) in enumerate(records):
+                    if field in vectors:
+                        vector = np.asarray(vectors[field], dtype=np.float32)
+                        norm = np.linalg.norm(vector)
+                        matrix[offset + i] = vector / norm if norm else vector
+                vector_rows[field] = matrix
+
+            self._vectors = {}
+            with open(os.path.join(self.path, "documents.jsonl"), "a", encoding="utf-8") as f:
+                for i, (plain, _) in enumerate(records):
+                    f.write(json.dumps({"row": first_row + i, "doc": plain}, ensure_ascii=False) + "\n")
+            for field, matrix in vector_rows.items():
+                with open(self._vectors_path(field), "ab") as f:
+                    f.write(matrix.tobytes())
+            with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"dimensions": self._dimensions}, f)
+
+            for i, (plain, _) in enumerate(records):
+                self._add(first_row + i, plain)
+            self._row_count = first_row + len(records)
+            for field in self._dimensions:
+                self._map_vectors(field)
+            return results
+
+    def _keyword_scores(self, search_text: str) -> dict:
+        n = len(self._rows)
+        if not n:
+            return {}
+        average_length = self._total_length / n or 1.0
+        scores = {}
+        for token in set(tokenize(search_text)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, tf in postings.items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[row] / average_length)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def _vector_scores(self, field: str, value: list, allowed_rows: set, k: int) -> dict:
+        matrix = self._vectors.get(field)
+        if matrix is None or not len(matrix):
+            return {}
+        query = np.asarray(value, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = matrix @ query
+        rows = np.fromiter(allowed_rows, dtype=np.int64, count=len(allowed_rows))
+        rows = rows[rows < len(scores)]
+        if not len(rows):
+            return {}
+        candidate_scores = scores[rows]
+        if len(rows) > k:
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+            rows, candidate_scores = rows[top], candidate_scores[top]
+        return {int(row): float(score) for row, score in zip(rows, candidate_scores)}
+
+    def search(self, search_text: str = None, vectors: list = None, filter: str = None,
+               select: list = None, top: int = None) -> list:
+        with self._lock:
+            predicate = _parse_filter(filter)
+            allowed = {row: key for key, row in self._rows.items()
+                       if predicate is None or predicate(self._documents[key])}
+
+            rankings = []
+            if search_text and search_text.strip() != "*":
+                scores = self._keyword_scores(search_text)
+                rankings.append({row: s for row, s in scores.items() if row in allowed})
+            for query in vectors or []:
+                for field in str(query.get("fields", "")).split(","):
+                    k = query.get("k") or query.get("k_nearest_neighbors") or top or DEFAULT_TOP
+                    rankings.append(self._vector_scores(field.strip(), query["value"], set(allowed), k))
+            if not rankings:
+                rankings.append({row: 1.0 for row in allowed})
+
+            if len(rankings) == 1:
+                scores = rankings[0]
+            else:
+                # hybrid query: fuse keyword and vector rankings like the service does
+                scores = {}
+                for ranking in rankings:
+                    for rank, row in enumerate(sorted(ranking, key=ranking.get, reverse=True), start=1):
+                        scores[row] = scores.get(row, 0.0) + 1.0 / (RRF_K + rank)
+
+            limit = top or DEFAULT_TOP
+            results = []
+            for row in sorted(scores, key=scores.get, reverse=True)[:limit]:
+                doc = self._documents[allowed[row]]
+                fields = select or list(doc)
+                result = {field: doc.get(field) for field in fields}
+                result["@search.score"] = scores[row]
+                results.append(result)
+            return results
+
+    def count(self) -> int:
+        return len(self._rows)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(name: str, directory: str = LOCAL_SEARCH_DIR) -> LocalSearchIndex:
+    name = name or DEFAULT_INDEX_NAME
+    with _indexes_lock:
+        index = _indexes.get((directory, name))
+        if index is None:
+            index = LocalSearchIndex(name, directory)
+            _indexes[(directory, name)] = index
+        return index
+
+
+class LocalSearchClient:
+    """
+    Drop-in replacement for the parts of azure.search.documents.SearchClient used by search_utils.
+    """
+
+    def __init__(self, index_name: str, directory: str = LOCAL_SEARCH_DIR):
+        self._index = get_local_index(index_name, directory)
+
+    def upload_documents(self, documents: list) -> list:
+        return self._index.upload_documents(documents)
+
+    def search(self, search_text: str = None, vectors: list = None, vector_queries: list = None,
+               filter: str = None, select: list = None, top: int = None, **kwargs) -> list:
+        queries = list(vectors or [])
+        for query in vector_queries or []:
+            queries.append({"value": query.vector, "fields": query.fields, "k": query.k_nearest_neighbors})
+        return self._index.search(search_text, queries, filter, select, top)
+
+    def get_document_count(self) -> int:
+        return self._index.count()
+
+
+class LocalSearchIndexClient:
+    """
+    Drop-in replacement for the parts of azure.search.documents.indexes.SearchIndexClient used by search_utils.
+    """
+
+    def __init__(self, directory: str = LOCAL_SEARCH_DIR):
+        self.directory = directory
+
+    def create_or_update_index(self, index) -> IndexInfo:
+        # like Azure, creating or updating an index keeps its documents; only delete_index removes them
+        name = getattr(index, "name", index)
+        index = get_local_index(name, self.directory)
+        os.makedirs(index.path, exist_ok=True)
+        return IndexInfo(name)
+
+    def list_index_names(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name))]
+
+    def delete_index(self, name: str):
+        get_local_index(name, self.directory).clear()
+        os.rmdir(os.path.join(self.directory, name))
@@ -0,0 +1,164 @@
+# utils/routing_utils.py
+import os
+import re
+import math
+import threading
+import unicodedata
+
+# Mots-clés par agent (sur le texte en minuscules et sans accents)
+DEFAULT_RULES = {
+    "document_agent": [
+        r"\barros", r"\btraitement", r"\btraiter\b", r"\bguide", r"\bfiche", r"\bconseil",
+        r"\bbesoin", r"\bengrais", r"\bfertilis", r"\btaill", r"\bsymptome", r"\bdocument", r"\bsoigner",
+        r"\bprevenir\b", r"\bprevention\b", r"\bcultiv", r"\bplant(er|ation)\b",
+    ],
+    "weather_agent": [
+        r"\bmeteo", r"\bpluie", r"\bpleu(t|voir|vra)", r"\btemperature", r"\bvent\b", r"\bgel(ee)?\b",
+        r"\borage", r"\bprevision", r"\bhumidite", r"\bgrele", r"\bsecheresse", r"\bweather\b", r"\brain\b",
+        r"\bforecast\b",
+    ],
+    "image_agent": [
+        r"\bimage", r"\bphoto", r"\bmalad", r"\bdiagnosti", r"\bcette feuille", r"\bces feuilles", r"\bpicture\b",
+    ],
+}
+
+# Phrases d'exemple utilisées pour les centroïdes d'embeddings
+DEFAULT_EXAMPLES = {
+    "document_agent": [
+        "Quels sont les besoins en eau de la vigne ?",
+        "Comment traiter le mildiou sur mes plants ?",
+        "Donne-moi la fiche technique de ce cépage",
+    ],
+    "weather_agent": [
+        "Va-t-il pleuvoir demain à Bordeaux ?",
+        "Quelles sont les prévisions météo pour cette semaine ?",
+        "Risque de gel cette nuit sur la parcelle ?",
+    ],
+    "image_agent": [
+        "Analyse cette photo de feuille",
+        "Ma plante est-elle malade sur cette image ?",
+        "Diagnostique l'état de ces feuilles",
+    ],
+}
+
+# score d'un agent : 0.2 + 0.4 par mot-clé trouvé, plafonné à 1 ; le seuil de sélection est
+# au-dessus du score d'un seul mot-clé (0.6) : il en faut au moins deux pour se passer du LLM
+RULE_BASE_SCORE = 0.2
+RULE_HIT_SCORE = 0.4
+SELECT_THRESHOLD = 0.75
+# similarités cosinus ramenées sur [0, 1] entre ces deux bornes
+SIMILARITY_LOW = 0.25
+SIMILARITY_HIGH = 0.55
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def is_reachable_source(source: dict) -> bool:
+    """Une source d'image compte si c'est une URL http(s) ou un chemin local existant."""
+    value = source.get("value") or ""
+    if source.get("type") == "url":
+        return value.startswith(("http://", "https://"))
+    return os.path.exists(value)
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LocalIntentRouter:
+    """
+    Routeur d'intentions local, sans appel LLM.
+
+    Combine des règles par mots-clés, la présence de sources d'images et, si une fonction `embed`
+    (liste de textes -> liste de vecteurs) est fournie, la similarité avec le centroïde des exemples
+    de chaque agent. route() retourne (plan, confiance) ; l'appelant se rabat sur le LLM quand la
+    confiance est trop faible. stats() indique la part des messages routés localement.
+    """
+
+    def __init__(self, rules=None, examples=None, embed=None, select_threshold=SELECT_THRESHOLD):
+        self.rules = {agent: [re.compile(p) for p in patterns]
+                      for agent, patterns in (rules or DEFAULT_RULES).items()}
+        self.examples = examples or DEFAULT_EXAMPLES
+        self.embed = embed
+        self.select_threshold = select_threshold
+        self._centroids = None
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.llm_fallbacks = 0
+
+    def _get_centroids(self):
+        with self._lock:
+            if self._centroids is None:
+                agents = list(self.examples)
+                texts = [text for agent in agents for text in self.examples[agent]]
+                vectors = self.embed(texts)
+                centroids = {}
+                position = 0
+                for agent in agents:
+                    count = len(self.examples[agent])
+                    group = vectors[position:position + count]
+                    position += count
+                    centroids[agent] = [sum(values) / count for values in zip(*group)]
+                self._centroids = centroids
+            return self._centroids
+
+    def score(self, message: str, image_sources=None) -> dict:
+        text = normalize_text(message)
+        scores = {}
+        for agent, patterns in self.rules.items():
+            hits = sum(1 for pattern in patterns if pattern.search(text))
+            scores[agent] = min(1.0, RULE_BASE_SCORE + RULE_HIT_SCORE * hits) if hits else 0.0
+        if image_sources and any(is_reachable_source(source) for source in image_sources):
+            scores["image_agent"] = 1.0
+        elif scores.get("image_agent"):
+            # parler d'image sans en fournir reste ambigu : la décision revient au LLM
+            scores["image_agent"] = min(scores["image_agent"], self.select_threshold / 2)
+
+        # les embeddings ne sont calculés que si les règles ne suffisent pas à trancher
+        conclusive = any(s >= self.select_threshold for s in scores.values()) and \
+            all(s == 0.0 or s >= self.select_threshold for s in scores.values())
+        if self.embed is not None and not conclusive:
+            try:
+                vector = self.embed([message])[0]
+                for agent, centroid in self._get_centroids().items():
+                    similarity = (_cosine(vector, centroid) - SIMILARITY_LOW) / (SIMILARITY_HIGH - SIMILARITY_LOW)
+                    scores[agent] = max(scores.get(agent, 0.0), min(1.0, max(0.0, similarity)))
+            except Exception:
+                pass
+        return scores
+
+    def route(self, message: str, image_sources=None, scores: dict = None):
+        """
+        Retourne (plan, confiance). La confiance est le plus faible score des agents retenus,
+        ou 0 si aucun agent n'est retenu ou si un agent reste ambigu (score non nul sous le seuil).
+        `scores` évite de recalculer score() quand l'appelant l'a déjà fait.
+        """
+        if scores is None:
+            scores = self.score(message, image_sources)
+        selected = [agent for agent, s in scores.items() if s >= self.select_threshold]
+        ambiguous = [agent for agent, s in scores.items() if 0.0 < s < self.select_threshold]
+        if not selected or ambiguous:
+            return [], 0.0
+        plan = [{"agent": agent, "reason": f"routage local (score {scores[agent]:.2f})"} for agent in selected]
+        return plan, min(scores[agent] for agent in selected)
+
+    def record(self, local: bool):
+        with self._lock:
+            if local:
+                self.local_hits += 1
+            else:
+                self.llm_fallbacks += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.local_hits + self.llm_fallbacks
+            return {
+                "local": self.local_hits,
+                "llm": self.llm_fallbacks,
+                "local_rate": self.local_hits / total if total else 0.0,
+            }
@@ -1,54 +1,261 @@
 # utils/search_utils.py
 import os
 import json
+import time
+import threading
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from dotenv import load_dotenv
-from azure.search.documents.indexes import SearchIndexClient
-from azure.core.credentials import AzureKeyCredential
-from utils.embeddings_utils import get_embedding
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes.models import (
-    SearchIndex,
-    SearchField,
-    SearchFieldDataType,
-    SimpleField,
-    SearchableField,
-    VectorSearch,
-    HnswAlgorithmConfiguration,
-    VectorSearchProfile,
-    SemanticConfiguration,
-    SemanticPrioritizedFields,
-    SemanticSearch,
-    SemanticField
-)
+from utils.embeddings_utils import get_embedding, get_embeddings
+from utils.cache_utils import TTLCache
 
 load_dotenv()
 
+# "azure" (default) or "local" for the in-process backend of utils/local_search_utils.py
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+
+if SEARCH_BACKEND == "local":
+    from utils.local_search_utils import LocalSearchClient, LocalSearchIndexClient
+else:
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes.models import (
+        SearchIndex,
+        SearchField,
+        SearchFieldDataType,
+        SimpleField,
+        SearchableField,
+        VectorSearch,
+        HnswAlgorithmConfiguration,
+        VectorSearchProfile,
+        SemanticConfiguration,
+        SemanticPrioritizedFields,
+        SemanticSearch,
+        SemanticField
+    )
+
 search_endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
 search_key = os.getenv("AZURE_SEARCH_KEY")
 index_name = os.getenv("AZURE_SEARCH_INDEX")
 
-credential = AzureKeyCredential(search_key)
-search_client = SearchClient(endpoint=search_endpoint, index_name=index_name, credential=credential)
+if SEARCH_BACKEND == "local":
+    search_client = LocalSearchClient(index_name)
+else:
+    credential = AzureKeyCredential(search_key)
+    search_client = SearchClient(endpoint=search_endpoint, index_name=index_name, credential=credential)
 
-def index_documents(documents: list):
-    docs_with_vector = []
+SEARCH_CACHE = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "600")),
+)
+
+_index_versions = {}
+_index_versions_lock = threading.Lock()
+
+
+def get_index_version(search_index_name: str) -> int:
+    """
+    Returns the in-process version of an index, bumped every time this module changes it.
+    Changes made by other processes are only picked up once cached entries expire.
+    """
+    with _index_versions_lock:
+        return _index_versions.get(search_index_name, 0)
+
+
+def bump_index_version(search_index_name: str) -> int:
+    """
+    Marks an index as modified and drops its cached search results.
+    """
+    with _index_versions_lock:
+        version = _index_versions.get(search_index_name, 0) + 1
+        _index_versions[search_index_name] = version
+    SEARCH_CACHE.invalidate(lambda key: key[0] == search_index_name)
+    return version
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+# Azure AI Search accepts at most 1000 documents and 16 MB per indexing request
+MAX_BATCH_DOCUMENTS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+# room left for the request envelope and the "@search.action" added to each document
+DOCUMENT_OVERHEAD_BYTES = 64
+UPLOAD_WORKERS = int(os.getenv("AZURE_SEARCH_UPLOAD_WORKERS", "4"))
+UPLOAD_MAX_RETRIES = 3
+# per-document statuses worth retrying (conflicts, throttling, service unavailable)
+RETRYABLE_STATUS_CODES = {409, 422, 429, 503}
+
+
+def _document_size(doc: dict) -> int:
+    return len(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")) + DOCUMENT_OVERHEAD_BYTES
+
+
+def split_into_batches(documents, max_documents: int = MAX_BATCH_DOCUMENTS, max_bytes: int = MAX_BATCH_BYTES):
+    """
+    Groups documents into batches that respect both the document count and the serialized size limits.
+    Accepts any iterable and yields lists, so the input is never fully materialized.
+    A document bigger than `max_bytes` is yielded alone and reported as failed by the service.
+    """
+    batch = []
+    batch_bytes = 0
     for doc in documents:
-        docs_with_vector.append({
-            "id": str(doc["id"]),
-            "title": doc["title"],
-            "content": doc["content"],
-            "content_vector": get_embedding(doc["content"])
-        })
+        size = _document_size(doc)
+        if batch and (len(batch) >= max_documents or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(doc)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _document_key(doc: dict, key_field: str):
+    key = doc.get(key_field)
+    return None if key is None else str(key)
+
+
+def _upload_batch(client, batch: list, key_field: str, max_retries: int):
+    """
+    Uploads one batch and retries only the documents whose IndexingResult failed with a retryable status.
+    Documents without a key are not sent: they are reported as failed with a 400 status and never retried.
+    Returns (number of succeeded documents, list of failures).
+    """
+    pending = [doc for doc in batch if _document_key(doc, key_field) is not None]
+    rejected = [{"key": None, "status_code": 400, "error_message": f"Document is missing its '{key_field}' key"}
+                for _ in range(len(batch) - len(pending))]
+    if not pending:
+        return 0, rejected
+    failures = {}
+    succeeded = 0
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(0.5 * 2 ** attempt, 10))
+        try:
+            results = client.upload_documents(documents=pending)
+        except Exception as e:
+            status_code = getattr(e, "status_code", None)
+            if status_code == 413 and len(pending) > 1:
+                # payload still too large for the service: split it in two and upload each half
+                pending_keys = {_document_key(doc, key_field) for doc in pending}
+                failures = {k: v for k, v in failures.items() if k not in pending_keys}
+                middle = len(pending) // 2
+                left_ok, left_failed = _upload_batch(client, pending[:middle], key_field, max_retries)
+                right_ok, right_failed = _upload_batch(client, pending[middle:], key_field, max_retries)
+                return (succeeded + left_ok + right_ok,
+                        rejected + list(failures.values()) + left_failed + right_failed)
+            for doc in pending:
+                key = _document_key(doc, key_field)
+                failures[key] = {"key": key, "status_code": status_code, "error_message": str(e)}
+            if status_code is not None and status_code not in RETRYABLE_STATUS_CODES:
+                break
+            continue
+
+        retry_keys = set()
+        for r in results:
+            if r.succeeded:
+                succeeded += 1
+                failures.pop(r.key, None)
+                continue
+            failures[r.key] = {"key": r.key, "status_code": r.status_code, "error_message": r.error_message}
+            if r.status_code in RETRYABLE_STATUS_CODES:
+                retry_keys.add(r.key)
+
+        pending = [doc for doc in pending if _document_key(doc, key_field) in retry_keys]
+        if not pending:
+            break
+
+    return succeeded, rejected + list(failures.values())
+
+
+def bulk_upload_documents(client, documents, key_field: str = "id",
+                          max_documents: int = MAX_BATCH_DOCUMENTS, max_bytes: int = MAX_BATCH_BYTES,
+                          max_workers: int = UPLOAD_WORKERS, max_retries: int = UPLOAD_MAX_RETRIES,
+                          on_batch_done=None, verbose: bool = True) -> dict:
+    """
+    Uploads documents to a search index in size-aware batches sent in parallel.
+
+    At most `max_workers` batches are in flight, so a large generator is consumed progressively.
+    `on_batch_done(batch, failures)` is called from the calling thread once each batch is settled.
+    Returns a report with the number of uploaded documents, the failed keys and the throughput.
+    """
+    start = time.perf_counter()
+    report = {"uploaded": 0, "failed": [], "batches": 0, "elapsed": 0.0, "docs_per_second": 0.0}
+    batches = {}
+
+    def collect(done):
+        for future in done:
+            succeeded, failed = future.result()
+            report["uploaded"] += succeeded
+            report["failed"].extend(failed)
+            batch = batches.pop(future)
+            if on_batch_done is not None:
+                on_batch_done(batch, failed)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for batch in split_into_batches(documents, max_documents, max_bytes):
+            if len(in_flight) >= max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(_upload_batch, client, batch, key_field, max_retries)
+            batches[future] = batch
+            in_flight.add(future)
+            report["batches"] += 1
+        collect(wait(in_flight).done)
+
+    report["elapsed"] = time.perf_counter() - start
+    if report["elapsed"] > 0:
+        report["docs_per_second"] = report["uploaded"] / report["elapsed"]
+
+    if verbose:
+        print(f"Uploaded {report['uploaded']} documents in {report['batches']} batches "
+              f"({report['elapsed']:.2f}s, {report['docs_per_second']:.1f} docs/s), {len(report['failed'])} failed")
+        for failure in report["failed"]:
+            print(f" - {failure['key']}: {failure['status_code']} {failure['error_message']}")
+    return report
 
-    result = search_client.upload_documents(documents=docs_with_vector)
-    return result
 
-def search_documents(query: str, k: int = 3):
-    vector = get_embedding(query)
+# documents embedded per get_embeddings call while indexing; the upload of a chunk overlaps the next one's embedding
+INDEX_EMBEDDING_CHUNK = int(os.getenv("AZURE_SEARCH_EMBEDDING_CHUNK", "256"))
 
+
+def _with_vectors(documents, chunk_size: int = INDEX_EMBEDDING_CHUNK):
+    iterator = iter(documents)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        vectors = get_embeddings([doc["content"] for doc in chunk])
+        for doc, vector in zip(chunk, vectors):
+            yield {
+                "id": str(doc["id"]),
+                "title": doc["title"],
+                "content": doc["content"],
+                "content_vector": vector
+            }
+
+
+def index_documents(documents: list):
+    docs_with_vector = _with_vectors(documents)
+
+    try:
+        return bulk_upload_documents(search_client, docs_with_vector)
+    finally:
+        bump_index_version(index_name)
+
+SEARCH_WORKERS = int(os.getenv("AZURE_SEARCH_QUERY_WORKERS", "8"))
+# smoothing constant of reciprocal-rank fusion, 60 as in the original paper
+RRF_K = 60
+
+def _vector_search(vector: list, k: int, filters: str = None, search_text: str = None) -> list:
     results = search_client.search(
-        search_text=None,
+        search_text=search_text,
         vectors=[
             {
                 "value": vector,
@@ -57,18 +264,85 @@ def search_documents(query: str, k: int = 3):
                 "kind": "vector"
             }
         ],
+        filter=filters,
+        top=k,
         select=["id", "title", "content"]
     )
-
     return [doc for doc in results]
 
+def _keyword_text(query: str):
+    # the local backend runs hybrid BM25 + vector queries, Azure keeps the pure vector query
+    return query if SEARCH_BACKEND == "local" else None
+
+def search_documents(query: str, k: int = 3, filters: str = None):
+    cache_key = (index_name, get_index_version(index_name), normalize_query(query), k, filters)
+    cached = SEARCH_CACHE.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    documents = _vector_search(get_embedding(query), k, filters, _keyword_text(query))
+    SEARCH_CACHE.set(cache_key, documents)
+    return list(documents)
+
+def reciprocal_rank_fusion(result_lists: list, key_field: str = "id", rrf_k: int = RRF_K) -> list:
+    """
+    Merges several ranked result lists into one, deduplicated on `key_field`.
+    Each document scores sum(1 / (rrf_k + rank)) over the lists it appears in; the score is added as "rrf_score".
+    """
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc[key_field]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [dict(documents[key], rrf_score=scores[key]) for key in ranked]
+
+def search_documents_many(queries: list, k: int = 3, filters: str = None, fuse: bool = False):
+    """
+    Runs several searches at once. Cached queries are answered directly, the others are embedded
+    in one batched call and searched concurrently over the shared search client.
+    Returns one result list per query, or a single list merged with reciprocal-rank fusion when `fuse` is True.
+    """
+    version = get_index_version(index_name)
+    keys = [(index_name, version, normalize_query(query), k, filters) for query in queries]
+    results = [SEARCH_CACHE.get(key) for key in keys]
+
+    # identical normalized queries are embedded and searched only once
+    pending = {}
+    for i, documents in enumerate(results):
+        if documents is None:
+            pending.setdefault(keys[i], []).append(i)
+
+    if pending:
+        texts = [queries[positions[0]] for positions in pending.values()]
+        vectors = get_embeddings(texts)
+        with ThreadPoolExecutor(max_workers=min(SEARCH_WORKERS, len(vectors))) as executor:
+            searched = list(executor.map(
+                lambda pair: _vector_search(pair[1], k, filters, _keyword_text(pair[0])),
+                zip(texts, vectors)
+            ))
+        for (key, positions), documents in zip(pending.items(), searched):
+            SEARCH_CACHE.set(key, documents)
+            for i in positions:
+                results[i] = documents
+
+    results = [list(documents) for documents in results]
+    if fuse:
+        return reciprocal_rank_fusion(results)
+    return results
+
 api_key = os.getenv("AI_SEARCH_KEY")
 endpoint = os.getenv("AI_SEARCH_ENDPOINT")
 
-credential = AzureKeyCredential(api_key)
+if SEARCH_BACKEND != "local":
+    credential = AzureKeyCredential(api_key)
 azure_search_service_endpoint = endpoint
 
 def get_search_index_client(search_index_name):
+    if SEARCH_BACKEND == "local":
+        return LocalSearchIndexClient()
 
     return SearchIndexClient(
         endpoint=azure_search_service_endpoint, 
@@ -79,6 +353,12 @@ def get_search_index_client(search_index_name):
 # create search index
 
 def create_search_index(search_index_name):
+    if SEARCH_BACKEND == "local":
+        # the local backend infers its schema from the uploaded documents
+        result = get_search_index_client(search_index_name).create_or_update_index(search_index_name)
+        bump_index_version(search_index_name)
+        print(f' {result.name} created')
+        return
 
     fields = [
         SimpleField(
@@ -128,6 +408,7 @@ def create_search_index(search_index_name):
     search_index = SearchIndex(name=search_index_name, fields=fields,
                         vector_search=vector_search, semantic_search=semantic_search)
     result = get_search_index_client(search_index_name).create_or_update_index(search_index)
+    bump_index_version(search_index_name)
     print(f' {result.name} created')
 
 def index_exists(client, index_name):
@@ -140,6 +421,7 @@ def delete_index_if_exists(search_index_name):
         if index_exists(client, search_index_name):
             print(f"Index '{search_index_name}' exists.")
             client.delete_index(search_index_name)
+            bump_index_version(search_index_name)
             print(f"Index '{search_index_name}' deleted.")
         else:
             print(f"Index '{search_index_name}' does not exist.")
@@ -147,7 +429,11 @@ def delete_index_if_exists(search_index_name):
         print(f"Error deleting index: {e}")
 
 
+@lru_cache(maxsize=None)
 def get_search_client(search_index_name):
+    if SEARCH_BACKEND == "local":
+        return LocalSearchClient(search_index_name)
+
     return  SearchClient(
         endpoint=endpoint,
         index_name=search_index_name,
@@ -155,15 +441,108 @@ def get_search_client(search_index_name):
     )
 
 
+def _load_chunk_file(filepath) -> list:
+    with open(filepath, 'r') as file:
+        document = json.load(file)
+    return document if isinstance(document, list) else [document]
+
+
 def upload_chunk_document(filepath, search_index_name):
     search_client = get_search_client(search_index_name)
     filename = os.path.basename(filepath)
 
     if filename.endswith('.json'):
-        with open(filepath, 'r') as file:
-            document = json.load(file)
-            print(f"Uploading {filename} to Azure Search Index...")
+        documents = _load_chunk_file(filepath)
+        print(f"Uploading {filename} to Azure Search Index...")
+
+        report = bulk_upload_documents(search_client, documents, verbose=False)
+        bump_index_version(search_index_name)
+        print(f"Upload of {filename} succeeded: { not report['failed'] }")
+        for failure in report["failed"]:
+            print(f" - {failure['key']}: {failure['status_code']} {failure['error_message']}")
+        return report
+
+
+def _read_checkpoint(checkpoint_path) -> set:
+    # one completed filename per line; a line cut short by a crash matches no file and is ignored
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r', encoding='utf-8') as file:
+        return {line.rstrip("\n") for line in file if line.strip()}
+
 
-            result = search_client.upload_documents(documents=document)
-            print(f"Upload of {filename} succeeded: { result[0].succeeded }")
+def upload_chunk_directory(directory, search_index_name, checkpoint_path=None,
+                           max_workers: int = UPLOAD_WORKERS, key_field: str = "id") -> dict:
+    """
+    Uploads every JSON chunk file of a directory through one shared search client.
+
+    Files are read one at a time and their documents coalesced into size-aware batches uploaded in parallel.
+    A file is recorded in the checkpoint once all its documents are indexed, so running the function again
+    after an interruption only uploads the files that are not completed. Files with failed documents are
+    left out of the checkpoint and retried on the next run.
+    """
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(directory, f".upload_checkpoint_{search_index_name}.log")
+    completed = _read_checkpoint(checkpoint_path)
+    filenames = sorted(entry.name for entry in os.scandir(directory)
+                       if entry.is_file() and entry.name.endswith('.json') and not entry.name.startswith('.'))
+    skipped = [name for name in filenames if name in completed]
+    if skipped:
+        print(f"Resuming: {len(skipped)} of {len(filenames)} files already uploaded")
+
+    # files still being uploaded: number of documents not settled yet, and whether one of them failed
+    remaining = {}
+    failed_files = set()
+    owners = {}
+
+    def settle(filename):
+        if remaining[filename] == 0 and filename not in failed_files:
+            completed.add(filename)
+            # append-only: each completed file costs one line, not a rewrite of the whole checkpoint
+            checkpoint.write(filename + "\n")
+            checkpoint.flush()
+
+    def documents():
+        for filename in filenames:
+            if filename in completed:
+                continue
+            try:
+                file_documents = _load_chunk_file(os.path.join(directory, filename))
+            except (OSError, ValueError) as e:
+                print(f"Skipping {filename}: {e}")
+                failed_files.add(filename)
+                continue
+            remaining[filename] = len(file_documents)
+            if not file_documents:
+                settle(filename)
+            for doc in file_documents:
+                owners[id(doc)] = filename
+                yield doc
+
+    def on_batch_done(batch, failures):
+        failed_keys = {failure["key"] for failure in failures}
+        touched = set()
+        for doc in batch:
+            filename = owners.pop(id(doc))
+            remaining[filename] -= 1
+            # a document without a key is reported failed by _upload_batch under no key at all
+            key = _document_key(doc, key_field)
+            if key is None or key in failed_keys:
+                failed_files.add(filename)
+            touched.add(filename)
+        for filename in touched:
+            settle(filename)
+
+    search_client = get_search_client(search_index_name)
+    try:
+        with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            report = bulk_upload_documents(search_client, documents(), key_field=key_field,
+                                           max_workers=max_workers, on_batch_done=on_batch_done)
+    finally:
+        bump_index_version(search_index_name)
 
+    report["files_completed"] = len(completed) - len(skipped)
+    report["files_skipped"] = len(skipped)
+    report["files_failed"] = sorted(failed_files)
+    print(f"{report['files_completed']} files uploaded, {len(skipped)} skipped, {len(failed_files)} failed")
+    return report
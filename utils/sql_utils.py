@@ -1,11 +1,62 @@
 import os
-import pyodbc
+import time
+import threading
+from collections import deque, namedtuple
+from functools import lru_cache
+from contextlib import contextmanager
+from itertools import islice
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# "azure" (défaut) pour Azure SQL via ODBC, "sqlite" pour une base locale de même API
+SQL_BACKEND = os.getenv("SQL_BACKEND", "azure").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "documents.db")
+
+if SQL_BACKEND == "sqlite":
+    import sqlite3
+else:
+    import pyodbc
+
+POOL_MIN_SIZE = int(os.getenv("AZURE_SQL_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("AZURE_SQL_POOL_MAX_SIZE", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("AZURE_SQL_POOL_IDLE_TIMEOUT", "300"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("AZURE_SQL_POOL_ACQUIRE_TIMEOUT", "30"))
+# une connexion restée inactive plus longtemps est vérifiée avant d'être rendue
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("AZURE_SQL_POOL_HEALTH_CHECK_AFTER", "30"))
+BULK_BATCH_SIZE = int(os.getenv("AZURE_SQL_BULK_BATCH_SIZE", "1000"))
+
+READ_PAGE_SIZE = int(os.getenv("AZURE_SQL_READ_PAGE_SIZE", "500"))
+
+DOCUMENT_COLUMNS = ("starting_line", "book", "book_name", "chapter", "chapter_name")
+ALL_DOCUMENT_COLUMNS = ("id",) + DOCUMENT_COLUMNS
+
+# Même schéma que utils/table.sql, en types SQLite
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        starting_line INTEGER,
+        book TEXT,
+        book_name TEXT,
+        chapter TEXT,
+        chapter_name TEXT
+    )
+"""
+
+def get_sqlite_connection(path=None):
+    # WAL : les lectures ne bloquent pas l'écriture ; cached_statements garde les requêtes préparées
+    conn = sqlite3.connect(path or SQLITE_PATH, timeout=30, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(SQLITE_SCHEMA)
+    conn.commit()
+    return conn
+
 # Connexion
 def get_connection():
+    if SQL_BACKEND == "sqlite":
+        return get_sqlite_connection()
     server = os.getenv("AZURE_SQL_SERVER")
     database = os.getenv("AZURE_SQL_DB")
     username = os.getenv("AZURE_SQL_USER")
@@ -20,45 +71,488 @@ def get_connection():
     )
     return pyodbc.connect(conn_str)
 
+# Pool de connexions
+class ConnectionPool:
+    """
+    Pool de connexions thread-safe.
+    - `connect` est la fonction qui ouvre une nouvelle connexion ;
+    - au plus `max_size` connexions ouvertes, `min_size` gardées même inactives ;
+    - les connexions inactives depuis plus de `idle_timeout` secondes sont fermées ;
+    - une connexion inactive depuis plus de `health_check_after` secondes est testée avant d'être rendue.
+    """
+
+    def __init__(self, connect, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER, health_check_query="SELECT 1"):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.health_check_query = health_check_query
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        # appelé avec le verrou : ferme les plus anciennes connexions inactives au-delà de min_size
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            idle_since = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Le pool de connexions est fermé")
+                    self._evict_idle()
+                    if self._idle:
+                        # LIFO : la connexion la plus récemment utilisée est la plus susceptible d'être valide
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Aucune connexion disponible après {self.acquire_timeout}s")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard()
+                    raise
+
+            if time.monotonic() - idle_since <= self.health_check_after or self._is_healthy(conn):
+                return conn
+            self._close_quietly(conn)
+            self._discard()
+
+    def _discard(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._close_quietly(conn)
+            self._discard()
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Emprunte une connexion et la rend au pool ; annule la transaction en cas d'erreur."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # BaseException: a KeyboardInterrupt or GeneratorExit must not leave the connection checked out
+            try:
+                conn.rollback()
+                self.release(conn)
+            except BaseException:
+                self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(get_connection)
+        return _pool
+
+# Unité de travail : transaction partagée par les opérations d'un même thread
+_local = threading.local()
+
+def _active_unit_of_work():
+    return getattr(_local, "unit_of_work", None)
+
+@contextmanager
+def _connection():
+    """Connexion de la transaction en cours sur ce thread, sinon une connexion empruntée au pool."""
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        yield unit_of_work.connection
+        return
+    with get_pool().connection() as conn:
+        yield conn
+
+def _commit(conn):
+    # dans une transaction, le commit est fait une seule fois à la sortie de transaction()
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is None or unit_of_work.connection is not conn:
+        conn.commit()
+
+def _flush_pending():
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.flush()
+
+class UnitOfWork:
+    """
+    Opérations d'écriture mises en file pendant une transaction. À chaque flush, les opérations
+    consécutives de même type sont regroupées en une instruction ensembliste (create_documents,
+    update_documents, delete_documents), dans l'ordre où elles ont été demandées.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_ids = []
+        self.updated = 0
+        self.deleted = 0
+        self._pending = []
+
+    def create(self, doc):
+        self._pending.append(("create", doc))
+
+    def update(self, document_id, new_title):
+        self._pending.append(("update", (document_id, new_title)))
+
+    def delete(self, document_id):
+        self._pending.append(("delete", document_id))
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        start = 0
+        while start < len(pending):
+            kind = pending[start][0]
+            end = start
+            while end < len(pending) and pending[end][0] == kind:
+                end += 1
+            payloads = [payload for _, payload in pending[start:end]]
+            if kind == "create":
+                self.created_ids.extend(create_documents(payloads))
+            elif kind == "update":
+                self.updated += update_documents(payloads)
+            else:
+                self.deleted += delete_documents(payloads)
+            start = end
+
+@contextmanager
+def transaction():
+    """
+    Regroupe les opérations de ce module appelées dans le bloc (sur le thread courant) sur une
+    seule connexion du pool, validées par un seul commit à la sortie ou annulées en cas d'erreur.
+    create_document, update_document et delete_document sont mis en file et envoyés par lots ;
+    les lectures et les appels en masse envoient d'abord les opérations en attente.
+    Une transaction imbriquée rejoint la transaction englobante.
+
+        with transaction() as uow:
+            create_document(doc)
+            update_document(1, "Nouveau titre")
+        print(uow.created_ids)
+    """
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        yield unit_of_work
+        return
+    with get_pool().connection() as conn:
+        unit_of_work = UnitOfWork(conn)
+        _local.unit_of_work = unit_of_work
+        try:
+            yield unit_of_work
+            unit_of_work.flush()
+        finally:
+            _local.unit_of_work = None
+        conn.commit()
+
 # CRUD sur la table documents
 def create_document(doc):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO documents (starting_line, book, book_name, chapter, chapter_name)
-        VALUES (?, ?, ?, ?, ?)
-    """, doc['starting_line'], doc['book'], doc['book_name'], doc['chapter'], doc['chapter_name'])
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def read_documents():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM documents")
-    rows = cursor.fetchall()
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.create(doc)
+        return
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO documents (starting_line, book, book_name, chapter, chapter_name)
+            VALUES (?, ?, ?, ?, ?)
+        """, (doc['starting_line'], doc['book'], doc['book_name'], doc['chapter'], doc['chapter_name']))
+        _commit(conn)
+        cursor.close()
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _create_documents_sqlite(docs, batch_size):
+    # dans une transaction d'écriture SQLite, les ids AUTOINCREMENT insérés se suivent
+    ids = []
+    with _connection() as conn:
+        cursor = conn.cursor()
+        for batch in _batched(docs, batch_size):
+            cursor.executemany(
+                "INSERT INTO documents (starting_line, book, book_name, chapter, chapter_name) VALUES (?, ?, ?, ?, ?)",
+                [tuple(doc[column] for column in DOCUMENT_COLUMNS) for doc in batch]
+            )
+            last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+            _commit(conn)
+        cursor.close()
+    return ids
+
+def create_documents(docs, batch_size=BULK_BATCH_SIZE):
+    """
+    Insertion en masse : les lignes sont envoyées par lots avec fast_executemany dans une table
+    temporaire, puis copiées dans documents en une instruction, une transaction par lot.
+    Accepte n'importe quel itérable et retourne les ids générés dans l'ordre des documents.
+    """
+    _flush_pending()
+    if SQL_BACKEND == "sqlite":
+        return _create_documents_sqlite(docs, batch_size)
+    ids = []
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.execute("""
+            IF OBJECT_ID('tempdb..#documents_staging') IS NOT NULL DROP TABLE #documents_staging;
+            CREATE TABLE #documents_staging (
+                seq INT PRIMARY KEY,
+                starting_line INT,
+                book NVARCHAR(100),
+                book_name NVARCHAR(255),
+                chapter NVARCHAR(100),
+                chapter_name NVARCHAR(MAX)
+            )
+        """)
+        try:
+            for batch in _batched(docs, batch_size):
+                cursor.execute("TRUNCATE TABLE #documents_staging")
+                cursor.executemany(
+                    "INSERT INTO #documents_staging VALUES (?, ?, ?, ?, ?, ?)",
+                    [(seq, *(doc[column] for column in DOCUMENT_COLUMNS)) for seq, doc in enumerate(batch)]
+                )
+                # INSERT ... SELECT ... ORDER BY attribue les identités dans l'ordre de seq,
+                # mais OUTPUT ne garantit pas l'ordre des lignes renvoyées : on les trie.
+                cursor.execute("""
+                    INSERT INTO documents (starting_line, book, book_name, chapter, chapter_name)
+                    OUTPUT INSERTED.id
+                    SELECT starting_line, book, book_name, chapter, chapter_name
+                    FROM #documents_staging ORDER BY seq
+                """)
+                ids.extend(sorted(row[0] for row in cursor.fetchall()))
+                _commit(conn)
+        finally:
+            cursor.execute("DROP TABLE #documents_staging")
+            cursor.close()
+    return ids
+
+@lru_cache(maxsize=None)
+def _row_type(columns):
+    return namedtuple("Document", columns)
+
+def _where_clause(filters):
+    """Construit la clause WHERE d'un dict {colonne: valeur} ou {colonne: [valeurs]} combiné par AND."""
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        if column not in ALL_DOCUMENT_COLUMNS:
+            raise ValueError(f"Colonne inconnue : {column}")
+        if value is None:
+            conditions.append(f"{column} IS NULL")
+        elif isinstance(value, (list, tuple, set)):
+            values = list(value)
+            if not values:
+                conditions.append("1 = 0")
+                continue
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        else:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    return conditions, params
+
+def iter_documents(columns=None, filters=None, page_size=READ_PAGE_SIZE):
+    """
+    Parcourt la table documents par pages de `page_size` lignes (pagination par clé sur id),
+    à mémoire constante. La connexion n'est empruntée au pool que le temps de lire une page.
+    - columns : colonnes à projeter, toutes par défaut ;
+    - filters : dict {colonne: valeur} ou {colonne: [valeurs]}, conditions combinées par AND.
+    Produit des namedtuples Document ne contenant que les colonnes demandées.
+    """
+    columns = tuple(columns or ALL_DOCUMENT_COLUMNS)
+    unknown = [column for column in columns if column not in ALL_DOCUMENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Colonnes inconnues : {unknown}")
+    # id est toujours lu en premier pour la pagination
+    selected = ("id",) + tuple(column for column in columns if column != "id")
+    positions = [selected.index(column) for column in columns]
+    row_type = _row_type(columns)
+    conditions, params = _where_clause(filters)
+
+    last_id = None
+    while True:
+        page_conditions = conditions + (["id > ?"] if last_id is not None else [])
+        where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+        page_params = params + ([last_id] if last_id is not None else [])
+        if SQL_BACKEND == "sqlite":
+            sql = f"SELECT {', '.join(selected)} FROM documents {where} ORDER BY id LIMIT ?"
+            page_params = page_params + [page_size]
+        else:
+            sql = f"SELECT TOP (?) {', '.join(selected)} FROM documents {where} ORDER BY id"
+            page_params = [page_size] + page_params
+
+        _flush_pending()
+        with _connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, page_params)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        for row in rows:
+            yield row_type(*(row[position] for position in positions))
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+def read_documents(columns=None, filters=None):
+    rows = list(iter_documents(columns, filters))
     for row in rows:
         print(row)
-    cursor.close()
-    conn.close()
+    return rows
 
 def update_document(document_id, new_title):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE documents SET chapter_name = ? WHERE id = ?
-    """, new_title, document_id)
-    conn.commit()
-    cursor.close()
-    conn.close()
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.update(document_id, new_title)
+        return
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE documents SET chapter_name = ? WHERE id = ?
+        """, (new_title, document_id))
+        _commit(conn)
+        cursor.close()
 
 def delete_document(document_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM documents WHERE id = ?", document_id)
-    conn.commit()
-    cursor.close()
-    conn.close()
+    unit_of_work = _active_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.delete(document_id)
+        return
+    with _connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        _commit(conn)
+        cursor.close()
+
+def _stage_batch(cursor, rows, batch_size):
+    """
+    Charge des lignes (id, valeur) dans une table temporaire de session documents_batch,
+    vidée à chaque appel, pour des UPDATE / DELETE ensemblistes par jointure.
+    """
+    if SQL_BACKEND == "sqlite":
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS documents_batch (id INTEGER PRIMARY KEY, value TEXT)")
+        cursor.execute("DELETE FROM temp.documents_batch")
+        insert = "INSERT INTO temp.documents_batch (id, value) VALUES (?, ?)"
+    else:
+        cursor.fast_executemany = True
+        cursor.execute("""
+            IF OBJECT_ID('tempdb..#documents_batch') IS NULL
+                CREATE TABLE #documents_batch (id INT PRIMARY KEY, value NVARCHAR(MAX));
+            TRUNCATE TABLE #documents_batch;
+        """)
+        insert = "INSERT INTO #documents_batch (id, value) VALUES (?, ?)"
+    for batch in _batched(rows, batch_size):
+        cursor.executemany(insert, batch)
+
+def update_documents(updates, batch_size=BULK_BATCH_SIZE):
+    """
+    Renomme plusieurs chapitres en une transaction : `updates` est un itérable de paires
+    (id, nouveau titre) ou un dict {id: nouveau titre}. Retourne le nombre de lignes modifiées.
+    """
+    _flush_pending()
+    pairs = dict(updates.items() if isinstance(updates, dict) else updates)
+    if not pairs:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        _stage_batch(cursor, list(pairs.items()), batch_size)
+        if SQL_BACKEND == "sqlite":
+            cursor.execute("""
+                UPDATE documents SET chapter_name = (SELECT b.value FROM temp.documents_batch b WHERE b.id = documents.id)
+                WHERE id IN (SELECT id FROM temp.documents_batch)
+            """)
+        else:
+            cursor.execute("""
+                UPDATE d SET d.chapter_name = b.value
+                FROM documents d JOIN #documents_batch b ON d.id = b.id
+            """)
+        affected = cursor.rowcount
+        _commit(conn)
+        cursor.close()
+    return affected
+
+def delete_documents(document_ids, batch_size=BULK_BATCH_SIZE):
+    """
+    Supprime plusieurs documents en une transaction. Retourne le nombre de lignes supprimées.
+    """
+    _flush_pending()
+    ids = list(dict.fromkeys(document_ids))
+    if not ids:
+        return 0
+    with _connection() as conn:
+        cursor = conn.cursor()
+        _stage_batch(cursor, [(document_id, None) for document_id in ids], batch_size)
+        if SQL_BACKEND == "sqlite":
+            cursor.execute("DELETE FROM documents WHERE id IN (SELECT id FROM temp.documents_batch)")
+        else:
+            cursor.execute("DELETE d FROM documents d JOIN #documents_batch b ON d.id = b.id")
+        affected = cursor.rowcount
+        _commit(conn)
+        cursor.close()
+    return affected
 
 # Exemple d'utilisation
 if __name__ == "__main__":
@@ -70,7 +564,8 @@ if __name__ == "__main__":
         "chapter_name": "The current doctrine of wages—its insufficiency"
     }
 
-    print(pyodbc.drivers())
+    if SQL_BACKEND != "sqlite":
+        print(pyodbc.drivers())
     create_document(document)
     read_documents()
     update_document(1, "Updated Chapter Title")